@@ -0,0 +1,141 @@
+import os, time, asyncio, itertools
+from fastapi import HTTPException
+from starlette.status import HTTP_503_SERVICE_UNAVAILABLE
+from . import database
+
+# Admission control in front of the DB-bound routes.
+# Every route takes a slot before it runs. There are as many slots as the engine pool can hand out
+# connections, so requests wait here (in a bounded, prioritised queue) instead of piling up in the
+# threadpool and on pool checkout. Anything that does not fit in the queue, or waits too long, is
+# shed straight away with a 503 and a Retry-After header.
+
+# lower rank = served first
+PRIORITIES = {"write": 0, "read": 1, "export": 2}
+
+class AdmissionLimiter:
+
+    def __init__(self, limit: int, queue_size: int, queue_timeout: float, retry_after: int, export_share: float):
+        self.limit = max(1, limit)
+        # exports (full table dumps) only get a share of the slots so they can't starve reads and writes
+        self.limits = {
+            "write": self.limit,
+            "read": self.limit,
+            "export": max(1, int(self.limit * export_share)),
+        }
+        self.queue_size = queue_size
+        self.queue_timeout = queue_timeout
+        self.retry_after = retry_after
+
+        self.in_flight = 0
+        self.in_flight_by_priority = {priority: 0 for priority in PRIORITIES}
+        self._waiters = []  # (rank, seq, priority, future)
+        self._seq = itertools.count()
+
+        self.admitted = {priority: 0 for priority in PRIORITIES}
+        self.queued = {priority: 0 for priority in PRIORITIES}
+        self.shed = {priority: {"queue_full": 0, "timeout": 0} for priority in PRIORITIES}
+        self.wait_seconds = 0.0
+
+    def _can_run(self, priority: str):
+        return self.in_flight < self.limit and self.in_flight_by_priority[priority] < self.limits[priority]
+
+    def _take(self, priority: str):
+        self.in_flight += 1
+        self.in_flight_by_priority[priority] += 1
+        self.admitted[priority] += 1
+
+    def _shed(self, priority: str, reason: str):
+        self.shed[priority][reason] += 1
+        raise HTTPException(
+            status_code=HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Service is overloaded, please retry later",
+            headers={"Retry-After": str(self.retry_after)},
+        )
+
+    def _wake(self):
+        # hand free slots to the highest priority waiters that are allowed to run
+        for entry in sorted(self._waiters):
+            rank, seq, priority, future = entry
+            if future.done():
+                self._waiters.remove(entry)
+            elif self._can_run(priority):
+                self._waiters.remove(entry)
+                self._take(priority)
+                future.set_result(True)
+
+    async def acquire(self, priority: str):
+        rank = PRIORITIES[priority]
+        # only jump the queue if nobody with the same or a higher priority is already waiting
+        if self._can_run(priority) and not any(entry[0] <= rank for entry in self._waiters):
+            self._take(priority)
+            return
+
+        if len(self._waiters) >= self.queue_size:
+            # a full queue makes room for a more important request by shedding the newest of its least important waiters
+            evicted = max(self._waiters, default=None)
+            if evicted is None or evicted[0] <= rank:
+                self._shed(priority, "queue_full")
+            self._waiters.remove(evicted)
+            evicted[3].set_result(False)
+
+        entry = (rank, next(self._seq), priority, asyncio.get_event_loop().create_future())
+        self._waiters.append(entry)
+        self.queued[priority] += 1
+        started = time.monotonic()
+        try:
+            admitted = await asyncio.wait_for(entry[3], timeout=self.queue_timeout)
+        except asyncio.TimeoutError:
+            if entry in self._waiters:
+                self._waiters.remove(entry)
+            self._shed(priority, "timeout")
+        finally:
+            self.wait_seconds += time.monotonic() - started
+        if not admitted:
+            self._shed(priority, "queue_full")
+
+    def release(self, priority: str):
+        self.in_flight -= 1
+        self.in_flight_by_priority[priority] -= 1
+        self._wake()
+
+    def stats(self):
+        return {
+            "limit": self.limit,
+            "limits": dict(self.limits),
+            "queue_size": self.queue_size,
+            "in_flight": self.in_flight,
+            "waiting": len(self._waiters),
+            "admitted": dict(self.admitted),
+            "queued": dict(self.queued),
+            "shed": {priority: dict(reasons) for priority, reasons in self.shed.items()},
+            "shed_total": sum(sum(reasons.values()) for reasons in self.shed.values()),
+            "wait_seconds": round(self.wait_seconds, 3),
+        }
+
+limiter = None
+
+# called by the startup event, once the settings are loaded
+def init_limiter():
+    global limiter
+    limiter = AdmissionLimiter(
+        limit=int(os.environ.get('ADMISSION_LIMIT', database.settings.pool_size + max(database.settings.max_overflow, 0))),
+        queue_size=int(os.environ.get('ADMISSION_QUEUE_SIZE', 50)),
+        queue_timeout=float(os.environ.get('ADMISSION_QUEUE_TIMEOUT', 5)),
+        retry_after=int(os.environ.get('ADMISSION_RETRY_AFTER', 1)),
+        export_share=float(os.environ.get('ADMISSION_EXPORT_SHARE', 0.5)),
+    )
+    return limiter
+
+# route dependencies, e.g. @app.get(..., dependencies=[Depends(admission.read)])
+def admit(priority: str):
+    async def slot():
+        await limiter.acquire(priority)
+        try:
+            yield
+        finally:
+            limiter.release(priority)
+    return slot
+
+write = admit("write")
+read = admit("read")
+export = admit("export")
@@ -0,0 +1,180 @@
+from pydantic import ValidationError
+from sqlalchemy.orm import Session
+from sqlalchemy import exc
+from . import schema, crud
+
+# Runs the operations of POST /batch on the crud functions, in one session and one transaction.
+# Runs of consecutive creates (or deletes) of the same resource are grouped: creates become a single INSERT
+# (crud.create_customers reserves the change_seq values and IDs up front), deletes a single DELETE ... WHERE id IN (...).
+# Every group runs in a savepoint: if it violates a constraint, its operations are run again one by one to find the one
+# that did. The first failing operation rolls the whole batch back.
+
+RESOURCES = {
+    "customer": {
+        "key": "customer_id",
+        "schema": schema.Customer,
+        "create": (schema.CustomerInput, crud.create_customers),
+        "update": (schema.Customer, crud.update_customer),
+        "delete": crud.delete_customers,
+    },
+    "purchase": {
+        "key": "purchase_id",
+        "schema": schema.Purchase,
+        "create": (schema.PurchaseInput, crud.create_purchases),
+        "update": (schema.Purchase, crud.update_purchase),
+        "delete": crud.delete_purchases,
+    },
+    "loyalty_level": {
+        "key": "level_id",
+        "schema": schema.LoyaltyLevel,
+        "create": (schema.LoyaltyLevel, crud.create_loyalty_levels),
+        "update": (schema.LoyaltyLevel, crud.update_loyalty_level),
+        "delete": crud.delete_loyalty_levels,
+    },
+}
+
+STATUS_CODES = {"create": 201, "update": 200, "delete": 200}
+
+# status code of the error for an operation violating an integrity constraint (unknown parent key, duplicate key,
+# record still referenced by others)
+CONSTRAINT_VIOLATED = 409
+
+class BatchError(Exception):
+    def __init__(self, index: int, status_code: int, detail):
+        self.index = index
+        self.status_code = status_code
+        self.detail = detail
+
+def is_ref(value):
+    return isinstance(value, dict) and list(value) == ["$ref"]
+
+# names of the references used by an operation
+def used_refs(operation: schema.BatchOperation):
+    values = list((operation.data or {}).values()) + [operation.id]
+    return {value["$ref"] for value in values if is_ref(value)}
+
+def resolve(value, refs: dict, index: int):
+    if not is_ref(value):
+        return value
+    if value["$ref"] not in refs:
+        raise BatchError(index, 422, "Unknown reference " + str(value["$ref"]) + ", it has to be created by an earlier operation")
+    return refs[value["$ref"]]
+
+# splits the operations into runs that can be executed together
+def group_operations(operations: list):
+    groups = []
+    for index, operation in enumerate(operations):
+        if groups and operation.method in ("create", "delete"):
+            group = groups[-1]
+            first = group[0][1]
+            same_kind = (first.method, first.resource) == (operation.method, operation.resource)
+            # an operation can't be grouped with the one creating the ID it refers to
+            group_refs = {other.ref for _, other in group if other.ref}
+            if same_kind and not (used_refs(operation) & group_refs):
+                group.append((index, operation))
+                continue
+        groups.append([(index, operation)])
+    return groups
+
+# one query for the loyalty levels of all the given (index, customer) pairs
+def check_loyalty_levels(db: Session, items: list):
+    existing = crud.get_loyalty_level_ids(db, [item.level_id for _, item in items])
+    for index, item in items:
+        if item.level_id not in existing:
+            raise BatchError(index, CONSTRAINT_VIOLATED, str(item.level_id) + " is not a valid loyalty level id.")
+
+def constraint_violated(index: int, error: exc.IntegrityError):
+    return BatchError(index, CONSTRAINT_VIOLATED, "Integrity constraint violated: " + str(error.orig))
+
+# runs `run` (a crud function taking a list) on all the items of the group at once, in a savepoint.
+# If that violates a constraint, the items are run again one at a time to tell which operation violated it
+def run_grouped(db: Session, group: list, items: list, run):
+    try:
+        with db.begin_nested():
+            results = run(db, items, commit=False)
+            db.flush()
+        return results
+    except exc.IntegrityError:
+        pass
+
+    results = []
+    for (index, operation), item in zip(group, items):
+        try:
+            with db.begin_nested():
+                results += run(db, [item], commit=False)
+                db.flush()
+        except exc.IntegrityError as e:
+            raise constraint_violated(index, e)
+    return results
+
+def run_create(db: Session, group: list, refs: dict):
+    resource = RESOURCES[group[0][1].resource]
+    input_schema, create = resource["create"]
+    items = []
+    for index, operation in group:
+        data = {name: resolve(value, refs, index) for name, value in (operation.data or {}).items()}
+        try:
+            items.append(input_schema(**data))
+        except ValidationError as e:
+            raise BatchError(index, 422, e.errors())
+    if group[0][1].resource == "customer":
+        check_loyalty_levels(db, [(index, item) for (index, _), item in zip(group, items)])
+
+    results = []
+    for (index, operation), db_item in zip(group, run_grouped(db, group, items, create)):
+        if operation.ref:
+            refs[operation.ref] = getattr(db_item, resource["key"])
+        results.append((index, operation, db_item))
+    return results
+
+def run_update(db: Session, group: list, refs: dict):
+    index, operation = group[0]
+    resource = RESOURCES[operation.resource]
+    input_schema, update = resource["update"]
+    data = {name: resolve(value, refs, index) for name, value in (operation.data or {}).items()}
+    try:
+        item = input_schema(**data)
+    except ValidationError as e:
+        raise BatchError(index, 422, e.errors())
+    if operation.resource == "customer":
+        check_loyalty_levels(db, [(index, item)])
+    try:
+        result = update(db, item, commit=False)
+    except exc.IntegrityError as e:
+        raise constraint_violated(index, e)
+    if result == 404:
+        raise BatchError(index, 404, "Could not find a " + operation.resource + " with key (" + resource["key"] + "=" + str(getattr(item, resource["key"])) + ")")
+    return [(index, operation, result)]
+
+def run_delete(db: Session, group: list, refs: dict):
+    resource = RESOURCES[group[0][1].resource]
+    ids = [resolve(operation.id, refs, index) for index, operation in group]
+    deleted = {getattr(db_item, resource["key"]): db_item for db_item in run_grouped(db, group, ids, resource["delete"])}
+    results = []
+    for (index, operation), id in zip(group, ids):
+        if id not in deleted:
+            raise BatchError(index, 404, "Could not find a " + operation.resource + " with key (" + resource["key"] + "=" + str(id) + ")")
+        results.append((index, operation, deleted[id]))
+    return results
+
+RUNNERS = {"create": run_create, "update": run_update, "delete": run_delete}
+
+def run_batch(db: Session, operations: list):
+    refs = {}
+    results = []
+    try:
+        crud.begin_write(db)
+        for group in group_operations(operations):
+            for index, operation, db_item in RUNNERS[group[0][1].method](db, group, refs):
+                # serialized before the commit, deleted records can't be loaded afterwards
+                results.append({
+                    "index": index,
+                    "ref": operation.ref,
+                    "status_code": STATUS_CODES[operation.method],
+                    "result": RESOURCES[operation.resource]["schema"].from_orm(db_item).dict(),
+                })
+        db.commit()
+    except BatchError:
+        db.rollback()
+        raise
+    return results
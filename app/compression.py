@@ -0,0 +1,220 @@
+import os, time, zlib, threading
+from starlette.datastructures import Headers, MutableHeaders
+
+# Response compression negotiated from Accept-Encoding (gzip, br, zstd).
+# Bodies are compressed chunk by chunk as they are sent, so streamed responses are compressed incrementally
+# and never buffered. Responses smaller than COMPRESSION_MINIMUM_SIZE, responses that already have a
+# Content-Encoding and already compressed content types (images, archives...) are sent as they are.
+# The settings below are read from the environment by init_compression(), called by the startup event.
+
+# server preference, used when the client accepts several encodings with the same q-value
+COMPRESSION_ENCODINGS = ["gzip"]
+COMPRESSION_MINIMUM_SIZE = 1024
+COMPRESSION_LEVELS = {"gzip": 6, "br": 4, "zstd": 3}
+
+# optional encoders, imported by init_compression() only if they are enabled and installed
+brotli = None
+zstandard = None
+
+ALREADY_COMPRESSED_TYPES = (
+    "image/jpeg", "image/png", "image/gif", "image/webp", "video/", "audio/",
+    "application/zip", "application/gzip", "application/x-gzip", "application/zstd", "application/x-7z-compressed",
+)
+
+class GzipEncoder:
+    def __init__(self, level: int):
+        self.compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+
+    def compress(self, data: bytes):
+        return self.compressor.compress(data) + self.compressor.flush(zlib.Z_SYNC_FLUSH)
+
+    def finish(self):
+        return self.compressor.flush()
+
+class BrotliEncoder:
+    def __init__(self, level: int):
+        self.compressor = brotli.Compressor(quality=level)
+
+    def compress(self, data: bytes):
+        return self.compressor.process(data) + self.compressor.flush()
+
+    def finish(self):
+        return self.compressor.finish()
+
+class ZstdEncoder:
+    def __init__(self, level: int):
+        self.compressor = zstandard.ZstdCompressor(level=level).compressobj()
+
+    def compress(self, data: bytes):
+        return self.compressor.compress(data) + self.compressor.flush(zstandard.COMPRESSOBJ_FLUSH_BLOCK)
+
+    def finish(self):
+        return self.compressor.flush()
+
+ENCODERS = {"gzip": GzipEncoder}
+
+def init_compression():
+    global COMPRESSION_ENCODINGS, COMPRESSION_MINIMUM_SIZE, brotli, zstandard
+    COMPRESSION_ENCODINGS = [encoding.strip() for encoding in os.environ.get('COMPRESSION_ENCODINGS', 'zstd,br,gzip').split(',') if encoding.strip()]
+    COMPRESSION_MINIMUM_SIZE = int(os.environ.get('COMPRESSION_MINIMUM_SIZE', 1024))
+    COMPRESSION_LEVELS.update({
+        "gzip": int(os.environ.get('COMPRESSION_GZIP_LEVEL', 6)),
+        "br":   int(os.environ.get('COMPRESSION_BROTLI_LEVEL', 4)),
+        "zstd": int(os.environ.get('COMPRESSION_ZSTD_LEVEL', 3)),
+    })
+    if "br" in COMPRESSION_ENCODINGS:
+        try:
+            import brotli
+            ENCODERS["br"] = BrotliEncoder
+        except ImportError:
+            pass
+    if "zstd" in COMPRESSION_ENCODINGS:
+        try:
+            import zstandard
+            ENCODERS["zstd"] = ZstdEncoder
+        except ImportError:
+            pass
+
+class CompressionMetrics:
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.responses = {}  # encoding -> {"responses", "bytes_in", "bytes_out", "cpu_seconds"}
+        self.skipped = {"not_accepted": 0, "too_small": 0, "already_compressed": 0}
+
+    def skip(self, reason: str):
+        with self.lock:
+            self.skipped[reason] += 1
+
+    def record(self, encoding: str, bytes_in: int, bytes_out: int, cpu_seconds: float):
+        with self.lock:
+            counters = self.responses.setdefault(encoding, {"responses": 0, "bytes_in": 0, "bytes_out": 0, "cpu_seconds": 0.0})
+            counters["responses"] += 1
+            counters["bytes_in"] += bytes_in
+            counters["bytes_out"] += bytes_out
+            counters["cpu_seconds"] += cpu_seconds
+
+    def stats(self):
+        with self.lock:
+            return {
+                "available_encodings": [encoding for encoding in COMPRESSION_ENCODINGS if encoding in ENCODERS],
+                "minimum_size": COMPRESSION_MINIMUM_SIZE,
+                "encodings": {
+                    encoding: dict(
+                        counters,
+                        cpu_seconds=round(counters["cpu_seconds"], 6),
+                        ratio=round(counters["bytes_in"] / counters["bytes_out"], 3) if counters["bytes_out"] else None,
+                    )
+                    for encoding, counters in self.responses.items()
+                },
+                "skipped": dict(self.skipped),
+            }
+
+metrics = CompressionMetrics()
+
+# picks the encoding to use for an Accept-Encoding header, None if the client accepts none of ours
+def negotiate(accept_encoding: str):
+    accepted = {}
+    for item in accept_encoding.split(","):
+        name, _, params = item.strip().partition(";")
+        q = 1.0
+        if params.strip().startswith("q="):
+            try:
+                q = float(params.strip()[2:])
+            except ValueError:
+                q = 0.0
+        accepted[name.strip().lower()] = q
+
+    candidates = []
+    for preference, encoding in enumerate(COMPRESSION_ENCODINGS):
+        if encoding not in ENCODERS:
+            continue
+        q = accepted.get(encoding, accepted.get("*", 0.0))
+        if q > 0:
+            candidates.append((-q, preference, encoding))
+    return min(candidates)[2] if candidates else None
+
+def is_compressible(headers: Headers):
+    if "content-encoding" in headers:
+        return False
+    content_type = headers.get("content-type", "")
+    return not content_type.startswith(ALREADY_COMPRESSED_TYPES)
+
+class CompressionMiddleware:
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        encoding = negotiate(Headers(scope=scope).get("accept-encoding", ""))
+        if not encoding:
+            metrics.skip("not_accepted")
+            await self.app(scope, receive, send)
+            return
+
+        start_message = None
+        encoder = None
+        bytes_in = bytes_out = 0
+        cpu_seconds = 0.0
+
+        async def send_compressed(message):
+            nonlocal start_message, encoder, bytes_in, bytes_out, cpu_seconds
+
+            if message["type"] == "http.response.start":
+                # held back until the first body chunk tells us if the response is worth compressing
+                start_message = message
+                return
+
+            if message["type"] != "http.response.body":
+                await send(message)
+                return
+
+            body = message.get("body", b"")
+            more_body = message.get("more_body", False)
+            headers = None
+
+            if start_message is not None:
+                headers = MutableHeaders(raw=start_message["headers"])
+                if not is_compressible(headers):
+                    metrics.skip("already_compressed")
+                elif not more_body and len(body) < COMPRESSION_MINIMUM_SIZE:
+                    metrics.skip("too_small")
+                elif more_body and int(headers.get("content-length", COMPRESSION_MINIMUM_SIZE)) < COMPRESSION_MINIMUM_SIZE:
+                    metrics.skip("too_small")
+                else:
+                    encoder = ENCODERS[encoding](COMPRESSION_LEVELS[encoding])
+                    headers["Content-Encoding"] = encoding
+                    headers.add_vary_header("Accept-Encoding")
+                    del headers["Content-Length"]
+
+            if encoder is None:
+                if start_message is not None:
+                    await send(start_message)
+                    start_message = None
+                await send(message)
+                return
+
+            started = time.thread_time()
+            compressed = encoder.compress(body) if body else b""
+            if not more_body:
+                compressed += encoder.finish()
+            cpu_seconds += time.thread_time() - started
+            bytes_in += len(body)
+            bytes_out += len(compressed)
+
+            if start_message is not None:
+                if not more_body:
+                    # the whole body came in one message, so its compressed length is known
+                    headers["Content-Length"] = str(len(compressed))
+                await send(start_message)
+                start_message = None
+            if compressed or not more_body:
+                await send({"type": "http.response.body", "body": compressed, "more_body": more_body})
+            if not more_body:
+                metrics.record(encoding, bytes_in, bytes_out, cpu_seconds)
+
+        await self.app(scope, receive, send_compressed)
@@ -0,0 +1,53 @@
+import os, time, threading
+from sqlalchemy.orm import Session
+from . import crud
+
+# Total counts for the list endpoints (?count=exact|estimate|none, returned in the X-Total-Count header).
+# estimate: the row count from the optimizer statistics, answered without touching the table.
+#           Filtered lists (and tables without statistics) fall back to the exact count.
+# exact:    SELECT COUNT(*), cached for COUNT_CACHE_TTL seconds per table and filter combination.
+
+COUNT_MODES = ("exact", "estimate", "none")
+COUNT_HEADER = "X-Total-Count"
+
+COUNT_CACHE_TTL = 5
+COUNT_CACHE_SIZE = 1000
+
+cache = {}  # (table_name, *filters) -> (expires, count)
+cache_lock = threading.Lock()
+
+# called by the startup event, once the settings are loaded
+def init_cache():
+    global COUNT_CACHE_TTL, COUNT_CACHE_SIZE
+    COUNT_CACHE_TTL = float(os.environ.get('COUNT_CACHE_TTL', 5))
+    COUNT_CACHE_SIZE = int(os.environ.get('COUNT_CACHE_SIZE', 1000))
+    cache.clear()
+
+def exact_count(key: tuple, count):
+    now = time.monotonic()
+    with cache_lock:
+        cached = cache.get(key)
+        if cached and cached[0] > now:
+            return cached[1]
+
+    result = count()
+
+    with cache_lock:
+        if len(cache) >= COUNT_CACHE_SIZE:
+            for expired in [key for key, (expires, _) in cache.items() if expires <= now]:
+                del cache[expired]
+            if len(cache) >= COUNT_CACHE_SIZE:
+                cache.clear()
+        cache[key] = (now + COUNT_CACHE_TTL, result)
+    return result
+
+# returns the total count for the given mode, None for count=none.
+# `count` is called without arguments to get the exact count, `filters` are the values it filters on
+def total_count(db: Session, mode: str, table_name: str, count, *filters):
+    if mode == "none":
+        return None
+    if mode == "estimate" and all(value is None for value in filters):
+        estimate = crud.estimate_row_count(db, table_name)
+        if estimate is not None:
+            return estimate
+    return exact_count((table_name,) + filters, count)
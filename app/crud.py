@@ -1,37 +1,162 @@
+import re
+from datetime import date, timedelta
 from sqlalchemy.orm import Session
-from sqlalchemy import func, or_, exc
+from sqlalchemy import func, or_, exc, text, select, insert, literal
 from fastapi.encoders import jsonable_encoder
-from . import model, schema
+from . import model, schema, database
+
+# -- Change feed --#
+
+CHANGE_COUNTER = "change_seq"
+
+# reserves `count` consecutive change_seq values and returns the first one.
+# The counter is bumped with an UPDATE before it's read, so the row lock (on SQLite, the database write lock)
+# is taken first and two writers can never read the same value. The lock is held until the caller commits,
+# see model.ChangeCounter for what that costs
+def next_change_seq(db: Session, count: int = 1):
+    counter = db.query(model.ChangeCounter).filter(model.ChangeCounter.name == CHANGE_COUNTER)
+    if not counter.update({model.ChangeCounter.value: model.ChangeCounter.value + count}, synchronize_session=False):
+        db.add(model.ChangeCounter(name=CHANGE_COUNTER, value=count))
+        db.flush()
+        return 1
+    return counter.with_entities(model.ChangeCounter.value).scalar() - count + 1
+
+def add_tombstones(db: Session, table_name: str, row_ids: list):
+    if not row_ids:
+        return
+    first_seq = next_change_seq(db, len(row_ids))
+    db.add_all([model.ChangeTombstone(change_seq=first_seq + i, table_name=table_name, row_id=row_id) for i, row_id in enumerate(row_ids)])
+
+# tombstones every `entity` row matching `criteria` with a single INSERT ... SELECT, for deletes too large to load the IDs.
+# The counter is locked before counting, so no write can add matching rows before the caller deletes them.
+# hidden tombstones get negative change_seq values, which the feed doesn't read, until publish_tombstones().
+# Returns the first reserved change_seq and the number of tombstones
+def add_tombstones_where(db: Session, entity, key, *criteria, hidden: bool = False):
+    next_change_seq(db, 0)
+    count = db.query(entity).filter(*criteria).count()
+    if not count:
+        return None, 0
+    first_seq = next_change_seq(db, count)
+    change_seq = literal(first_seq - 1) + func.row_number().over(order_by=key)
+    rows = select(-change_seq if hidden else change_seq, literal(entity.__tablename__), key).where(*criteria)
+    db.execute(insert(model.ChangeTombstone).from_select(["change_seq", "table_name", "row_id"], rows))
+    return first_seq, count
+
+def hidden_tombstones(db: Session, first_seq: int, count: int):
+    return db.query(model.ChangeTombstone).filter(
+        model.ChangeTombstone.change_seq <= -first_seq,
+        model.ChangeTombstone.change_seq > -(first_seq + count)
+    )
+
+# makes hidden tombstones visible under newly reserved change_seq values (in the same order), so they come after
+# any change made to their rows in the meantime
+def publish_tombstones(db: Session, first_seq: int, count: int):
+    new_first_seq = next_change_seq(db, count)
+    hidden_tombstones(db, first_seq, count).update(
+        {model.ChangeTombstone.change_seq: new_first_seq - first_seq - model.ChangeTombstone.change_seq}, synchronize_session=False)
+
+# pysqlite only opens a transaction right before an INSERT/UPDATE/DELETE, and a SAVEPOINT issued outside of one
+# commits when it's released. Writers that use savepoints open theirs explicitly, taking the write lock straight away
+def begin_write(db: Session):
+    if db.get_bind().dialect.name == "sqlite":
+        db.execute(text("BEGIN IMMEDIATE"))
+
+# reserves `count` primary key values of `column`, so a group of rows can be inserted with one executemany
+# instead of one INSERT ... RETURNING per row. Oracle: from the column's sequence. SQLite: from the current maximum,
+# the caller already holds the write lock (next_change_seq or begin_write)
+def reserve_ids(db: Session, column, count: int):
+    if db.get_bind().dialect.name == "oracle":
+        return db.execute(text(
+            "SELECT " + column.default.name + ".NEXTVAL FROM dual CONNECT BY LEVEL <= :count"
+        ), {"count": count}).scalars().all()
+    first_id = (db.query(func.max(column)).scalar() or 0) + 1
+    return list(range(first_id, first_id + count))
+
+# -- Counts --#
+
+# row count from the optimizer statistics (as of the last stats gathering / ANALYZE), None when there are none.
+# Oracle keeps it in user_tables.num_rows, SQLite in the first number of sqlite_stat1.stat
+def estimate_row_count(db: Session, table_name: str):
+    dialect = db.get_bind().dialect.name
+    if dialect == "oracle":
+        return db.execute(text(
+            "SELECT num_rows FROM user_tables WHERE table_name = :table_name"
+        ), {"table_name": table_name.upper()}).scalar()
+    if dialect == "sqlite":
+        if not db.execute(text("SELECT 1 FROM sqlite_master WHERE name = 'sqlite_stat1'")).scalar():
+            return None
+        stats = db.execute(text(
+            "SELECT stat FROM sqlite_stat1 WHERE tbl = :table_name"
+        ), {"table_name": table_name}).scalars().all()
+        return max((int(stat.split()[0]) for stat in stats), default=None)
+    return None
+
+# returns up to `limit` changes newer than `since` ordered by change_seq as (change_seq, row_id, row) tuples,
+# where row is None for deleted rows, plus a flag telling if there are more changes to fetch
+def get_changes(db: Session, entity, key, table_name: str, since: int, limit: int):
+    rows = db.query(entity).filter(
+        entity.change_seq > since
+    ).order_by(entity.change_seq).limit(limit + 1).all()
+    tombstones = db.query(model.ChangeTombstone).filter(
+        model.ChangeTombstone.table_name == table_name,
+        model.ChangeTombstone.change_seq > since
+    ).order_by(model.ChangeTombstone.change_seq).limit(limit + 1).all()
+
+    changes = [(row.change_seq, getattr(row, key), row) for row in rows]
+    changes += [(tombstone.change_seq, tombstone.row_id, None) for tombstone in tombstones]
+    changes.sort(key=lambda change: change[0])
+    return changes[:limit], len(changes) > limit
 
 # -- Customer --#
 
 def get_customers(db: Session):
     return db.query(model.Customer).all()
 
+def count_customers(db: Session):
+    return db.query(model.Customer).count()
+
 def get_customer(db: Session, customer_id: int):
     return db.query(model.Customer).filter(
         model.Customer.customer_id == customer_id
     ).all()
 
-def create_customer(db: Session, customer: schema.CustomerInput):   
+def get_customer_changes(db: Session, since: int, limit: int):
+    return get_changes(db, model.Customer, "customer_id", model.Customer.__tablename__, since, limit)
+
+def create_customer(db: Session, customer: schema.CustomerInput, commit: bool = True):   
     db_item = model.Customer(firstname=customer.firstname, 
                                        lastname=customer.lastname, 
                                        date_of_birth=customer.date_of_birth, 
                                        level_id=customer.level_id,
-                                       signup_date=customer.signup_date
+                                       signup_date=customer.signup_date,
+                                       change_seq=next_change_seq(db)
                                        )
     # we can also populate the model using a shortcut:  
     # db_item = model.Customer(**customer.dict())                                        
     db.add(db_item)
-    db.commit()
-    db.refresh(db_item)
+    if commit:
+        db.commit()
+        db.refresh(db_item)
     return db_item
  
-def update_customer(db: Session, customer: schema.Customer): 
+# creates all the given customers with a single INSERT: the change_seq values and customer_ids are reserved up front,
+# so nothing has to be fetched back row by row
+def create_customers(db: Session, customers: list, commit: bool = True):
+    first_seq = next_change_seq(db, len(customers))
+    customer_ids = reserve_ids(db, model.Customer.customer_id, len(customers))
+    db_items = [model.Customer(customer_id=customer_id, change_seq=first_seq + i, **customer.dict())
+                for i, (customer_id, customer) in enumerate(zip(customer_ids, customers))]
+    db.add_all(db_items)
+    if commit:
+        db.commit()
+    return db_items
+
+def update_customer(db: Session, customer: schema.Customer, commit: bool = True): 
     existing_customer = db.query(model.Customer).filter(model.Customer.customer_id == customer.customer_id).first()
     if existing_customer:
-        db.query(model.Customer).filter(model.Customer.customer_id == existing_customer.customer_id).update(customer.dict())
-        db.commit()
+        db.query(model.Customer).filter(model.Customer.customer_id == existing_customer.customer_id).update(dict(customer.dict(), change_seq=next_change_seq(db)))
+        if commit:
+            db.commit()
         return existing_customer
     else:
         return 404
@@ -39,17 +164,44 @@ def update_customer(db: Session, customer: schema.Customer):
 def delete_customer(db: Session, customer_id: int): 
     existing_customer = db.query(model.Customer).filter(model.Customer.customer_id == customer_id).first()
     if existing_customer:
+        # purchases go away with the customer (ON DELETE CASCADE), so they need tombstones too
+        purchase_ids = [row.purchase_id for row in db.query(model.Purchase.purchase_id).filter(model.Purchase.customer_id == customer_id)]
+        add_tombstones(db, model.Purchase.__tablename__, purchase_ids)
+        add_tombstones(db, model.Customer.__tablename__, [customer_id])
         db.query(model.Customer).filter(model.Customer.customer_id == customer_id).delete()
         db.commit()
         return existing_customer
     else:
         return 404
 
+# deletes all the given customers with a single statement, returns the ones that existed
+def delete_customers(db: Session, customer_ids: list, commit: bool = True):
+    existing_customers = db.query(model.Customer).filter(model.Customer.customer_id.in_(customer_ids)).all()
+    existing_ids = [customer.customer_id for customer in existing_customers]
+    if existing_ids:
+        purchase_ids = [row.purchase_id for row in db.query(model.Purchase.purchase_id).filter(model.Purchase.customer_id.in_(existing_ids))]
+        add_tombstones(db, model.Purchase.__tablename__, purchase_ids)
+        add_tombstones(db, model.Customer.__tablename__, existing_ids)
+        db.query(model.Customer).filter(model.Customer.customer_id.in_(existing_ids)).delete(synchronize_session=False)
+        # the deleted customers (and the purchases that went with them) would otherwise stay in the session as if they
+        # still existed, and clash with new rows getting the same key later in the transaction
+        for instance in list(db):
+            if isinstance(instance, model.Purchase) and instance.customer_id in existing_ids:
+                db.expunge(instance)
+        for customer in existing_customers:
+            db.expunge(customer)
+        if commit:
+            db.commit()
+    return existing_customers
+
 # -- LoyaltyLevel --#
 
 def get_loyalty_levels(db: Session):
     return db.query(model.LoyaltyLevel).all()
 
+def count_loyalty_levels(db: Session):
+    return db.query(model.LoyaltyLevel).count()
+
 def get_loyalty_level(db: Session, level_id: int):
     return db.query(model.LoyaltyLevel).filter(
         model.LoyaltyLevel.level_id == level_id
@@ -60,18 +212,32 @@ def get_loyalty_level_count(db: Session, level_id: int):
         model.LoyaltyLevel.level_id == level_id
     ).count()
 
-def create_loyalty_level(db: Session, loyalty_level: schema.LoyaltyLevel):   
+# the level_ids among the given ones that exist
+def get_loyalty_level_ids(db: Session, level_ids: list):
+    return {row.level_id for row in db.query(model.LoyaltyLevel.level_id).filter(model.LoyaltyLevel.level_id.in_(set(level_ids)))}
+
+def create_loyalty_level(db: Session, loyalty_level: schema.LoyaltyLevel, commit: bool = True):   
     db_item = model.LoyaltyLevel(**loyalty_level.dict())                                  
     db.add(db_item)
-    db.commit()
-    db.refresh(db_item)
+    if commit:
+        db.commit()
+        db.refresh(db_item)
     return db_item
 
-def update_loyalty_level(db: Session, loyalty_level: schema.LoyaltyLevel): 
+# creates all the given loyalty levels with a single INSERT (their keys are given by the caller)
+def create_loyalty_levels(db: Session, loyalty_levels: list, commit: bool = True):
+    db_items = [model.LoyaltyLevel(**loyalty_level.dict()) for loyalty_level in loyalty_levels]
+    db.add_all(db_items)
+    if commit:
+        db.commit()
+    return db_items
+
+def update_loyalty_level(db: Session, loyalty_level: schema.LoyaltyLevel, commit: bool = True): 
     existing_loyalty_level = db.query(model.LoyaltyLevel).filter(model.LoyaltyLevel.level_id == loyalty_level.level_id).first()
     if existing_loyalty_level:
         db.query(model.LoyaltyLevel).filter(model.LoyaltyLevel.level_id == existing_loyalty_level.level_id).update(loyalty_level.dict())
-        db.commit()
+        if commit:
+            db.commit()
         return existing_loyalty_level
     else:
         return 404
@@ -85,10 +251,34 @@ def delete_loyalty_level(db: Session, level_id: int):
     else:
         return 404
 
+# deletes all the given loyalty levels with a single statement, returns the ones that existed
+def delete_loyalty_levels(db: Session, level_ids: list, commit: bool = True):
+    existing_loyalty_levels = db.query(model.LoyaltyLevel).filter(model.LoyaltyLevel.level_id.in_(level_ids)).all()
+    if existing_loyalty_levels:
+        db.query(model.LoyaltyLevel).filter(model.LoyaltyLevel.level_id.in_(level_ids)).delete(synchronize_session=False)
+        # see delete_customers
+        for loyalty_level in existing_loyalty_levels:
+            db.expunge(loyalty_level)
+        if commit:
+            db.commit()
+    return existing_loyalty_levels
+
 # -- Purchase --#
 
-def get_purchases(db: Session):
-    return db.query(model.Purchase).all()
+# date filters compare the bare purchase_date column against a half-open range (no TRUNC/TO_CHAR on the column),
+# so Oracle can prune the purchase partitions outside of it
+def filter_purchases(query, date_from: date = None, date_to: date = None):
+    if date_from:
+        query = query.filter(model.Purchase.purchase_date >= date_from)
+    if date_to:
+        query = query.filter(model.Purchase.purchase_date < date_to + timedelta(days=1))
+    return query
+
+def get_purchases(db: Session, date_from: date = None, date_to: date = None):
+    return filter_purchases(db.query(model.Purchase), date_from, date_to).all()
+
+def count_purchases(db: Session, date_from: date = None, date_to: date = None):
+    return filter_purchases(db.query(model.Purchase), date_from, date_to).count()
 
 def get_purchase(db: Session, purchase_id: int):
     return db.query(model.Purchase).filter(
@@ -100,22 +290,43 @@ def get_purchase_based_on_customer_id(db: Session, customer_id: int):
         model.Purchase.customer_id == customer_id
     ).all()
 
-def create_purchase(db: Session, purchase: schema.PurchaseInput):
+def get_purchase_changes(db: Session, since: int, limit: int):
+    return get_changes(db, model.Purchase, "purchase_id", model.Purchase.__tablename__, since, limit)
+
+def create_purchase(db: Session, purchase: schema.PurchaseInput, commit: bool = True):
     db_item = model.Purchase(**purchase.dict())    
     try:
+        db_item.change_seq = next_change_seq(db)
         db.add(db_item)
-        db.commit()
-        db.refresh(db_item)
+        if commit:
+            db.commit()
+            db.refresh(db_item)
         return db_item
     except exc.IntegrityError:
         db.rollback()
         return 404
 
-def update_purchase(db: Session, purchase: schema.Purchase): 
+# creates all the given purchases with a single INSERT, see create_customers
+def create_purchases(db: Session, purchases: list, commit: bool = True):
+    first_seq = next_change_seq(db, len(purchases))
+    purchase_ids = reserve_ids(db, model.Purchase.purchase_id, len(purchases))
+    db_items = [model.Purchase(purchase_id=purchase_id, change_seq=first_seq + i, **purchase.dict())
+                for i, (purchase_id, purchase) in enumerate(zip(purchase_ids, purchases))]
+    db.add_all(db_items)
+    if commit:
+        db.commit()
+    return db_items
+
+def update_purchase(db: Session, purchase: schema.Purchase, commit: bool = True): 
     existing_purchase = db.query(model.Purchase).filter(model.Purchase.customer_id == purchase.customer_id, model.Purchase.purchase_id == purchase.purchase_id).first()
     if existing_purchase:
-        db.query(model.Purchase).filter(model.Purchase.purchase_id == existing_purchase.purchase_id).update(purchase.dict())
-        db.commit()
+        values = purchase.dict()
+        if database.settings.purchase_partition_interval and values["purchase_date"] is None:
+            # the partition key can't be NULL, keep the current date
+            values["purchase_date"] = existing_purchase.purchase_date
+        db.query(model.Purchase).filter(model.Purchase.purchase_id == existing_purchase.purchase_id).update(dict(values, change_seq=next_change_seq(db)))
+        if commit:
+            db.commit()
         return existing_purchase
     else:
         return 404
@@ -123,10 +334,71 @@ def update_purchase(db: Session, purchase: schema.Purchase):
 def delete_purchase(db: Session, purchase_id: int): 
     existing_purchase = db.query(model.Purchase).filter(model.Purchase.purchase_id == purchase_id).first()
     if existing_purchase:
+        add_tombstones(db, model.Purchase.__tablename__, [existing_purchase.purchase_id])
         db.query(model.Purchase).filter(model.Purchase.purchase_id == existing_purchase.purchase_id).delete()
         db.commit()
         return existing_purchase
     else:
         return 404
 
-  
\ No newline at end of file
+# deletes all the given purchases with a single statement, returns the ones that existed
+def delete_purchases(db: Session, purchase_ids: list, commit: bool = True):
+    existing_purchases = db.query(model.Purchase).filter(model.Purchase.purchase_id.in_(purchase_ids)).all()
+    existing_ids = [purchase.purchase_id for purchase in existing_purchases]
+    if existing_ids:
+        add_tombstones(db, model.Purchase.__tablename__, existing_ids)
+        db.query(model.Purchase).filter(model.Purchase.purchase_id.in_(existing_ids)).delete(synchronize_session=False)
+        # see delete_customers
+        for purchase in existing_purchases:
+            db.expunge(purchase)
+        if commit:
+            db.commit()
+    return existing_purchases
+
+# drops one interval partition of the purchase table, with a tombstone for each of its purchases.
+# DROP PARTITION is DDL: it commits the tombstones before it runs, and can still fail (ORA-00054 after ddl_lock_timeout when
+# the partition has DML in flight). So the tombstones stay hidden until the partition is gone, and are removed if it isn't
+def drop_purchase_partition(db: Session, partition_name: str, lower_bound: date, upper_bound: date):
+    criteria = [model.Purchase.purchase_date < upper_bound]
+    if lower_bound:
+        criteria.append(model.Purchase.purchase_date >= lower_bound)
+    first_seq, count = add_tombstones_where(db, model.Purchase, model.Purchase.purchase_id, *criteria, hidden=True)
+    try:
+        db.execute(text('ALTER TABLE purchase DROP PARTITION "' + partition_name + '" UPDATE GLOBAL INDEXES'))
+    except exc.DBAPIError:
+        db.rollback()
+        if count:
+            hidden_tombstones(db, first_seq, count).delete(synchronize_session=False)
+            db.commit()
+        raise
+    if count:
+        publish_tombstones(db, first_seq, count)
+    db.commit()
+
+# retention: removes the purchases dated before `before`, with a tombstone for each of them in the change feed.
+# On a partitioned Oracle table the interval partitions entirely before the date are dropped (a dictionary operation,
+# no matter how many rows they hold). What's left before the date (the first partition, the partition the date falls in,
+# or the whole unpartitioned table) is deleted row by row
+def drop_purchases_before(db: Session, before: date):
+    dropped = []
+    if db.get_bind().dialect.name == "oracle" and database.settings.purchase_partition_interval:
+        partitions = []
+        for partition_name, high_value, interval in db.execute(text(
+            "SELECT partition_name, high_value, interval FROM user_tab_partitions WHERE table_name = 'PURCHASE'"
+        )):
+            # high_value looks like TO_DATE(' 2022-02-01 00:00:00', 'SYYYY-MM-DD HH24:MI:SS', 'NLS_CALENDAR=GREGORIAN')
+            partitions.append((date.fromisoformat(re.search(r"\d{4}-\d{2}-\d{2}", high_value).group(0)), partition_name, interval))
+        # wait for in-flight DML on a partition instead of failing straight away with ORA-00054
+        db.execute(text("ALTER SESSION SET ddl_lock_timeout = " + str(database.settings.ddl_lock_timeout)))
+        lower_bound = None
+        for upper_bound, partition_name, interval in sorted(partitions):
+            # the first partition is never dropped, the interval partitions start where it ends
+            if interval == 'YES' and upper_bound <= before:
+                drop_purchase_partition(db, partition_name, lower_bound, upper_bound)
+                dropped.append(partition_name)
+            lower_bound = upper_bound
+
+    add_tombstones_where(db, model.Purchase, model.Purchase.purchase_id, model.Purchase.purchase_date < before)
+    deleted = db.query(model.Purchase).filter(model.Purchase.purchase_date < before).delete(synchronize_session=False)
+    db.commit()
+    return {"partitions_dropped": dropped, "rows_deleted": deleted}
@@ -1,22 +1,76 @@
-import os, urllib
-from sqlalchemy import create_engine
+import os, sys, urllib
+from sqlalchemy import create_engine, event
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
 from sqlalchemy.engine.url import URL
+from sqlalchemy.pool import QueuePool
 #import pyodbc
-from dotenv import load_dotenv, find_dotenv
 
-load_dotenv(find_dotenv())
+# Nothing is read or connected when this module is imported. The startup event calls load_settings()
+# and then init_engine(), which is also when the Oracle driver gets imported.
 
-# ORACLE
-connect_url = URL(
-    "oracle+cx_oracle",
-    username=urllib.parse.quote_plus(str(os.environ.get('DB_USERNAME', 'DEFAULT_DB_USERNAME'))),
-    password=urllib.parse.quote_plus(str(os.environ.get('DB_PASSWORD', 'DEFAULT_DB_PASSWORD'))),
-    host=str(os.environ.get('DB_HOST', 'DEFAULT_DB_HOST')),
-    port=str(os.environ.get('DB_PORT', 'DEFAULT_DB_PORT')),
-    database=str(os.environ.get('DB_DATABASE', 'DEFAULT_DB_DATABASE')),
-)
+class Settings:
+    def __init__(self):
+        # ORACLE
+        # driver: "oracledb" (python-oracledb, thin mode by default: no Oracle Client libraries needed) or "cx_oracle"
+        self.db_driver = os.environ.get('DB_DRIVER', 'oracledb').lower()
+        # python-oracledb thick mode, for the features thin mode doesn't support. Needs the Oracle Client libraries
+        self.oracledb_thick_mode = os.environ.get('ORACLEDB_THICK_MODE', 'false').lower() in ('1', 'true', 'yes')
+        self.oracle_client_lib_dir = os.environ.get('ORACLE_CLIENT_LIB_DIR') or None
+        # driver tuning: statements cached per connection, rows fetched per round trip, rows returned with the execute itself
+        self.stmt_cache_size = int(os.environ.get('DB_STMT_CACHE_SIZE', 50))
+        self.arraysize = int(os.environ.get('DB_ARRAYSIZE', 500))
+        self.prefetch_rows = int(os.environ.get('DB_PREFETCH_ROWS', 2))
+
+        # SQLite stand-in for running locally without an Oracle database, e.g. DB_URL="sqlite:///./local.db"
+        # (plain tables, no partitioning)
+        self.db_url = os.environ.get('DB_URL')
+
+        # connection pool sizing (also used by the admission limiter in app/admission.py)
+        self.pool_size = int(os.environ.get('DB_POOL_SIZE', 5))
+        self.max_overflow = int(os.environ.get('DB_MAX_OVERFLOW', 10))
+
+        # range partitioning of the purchase table on purchase_date, Oracle only (see model.Purchase).
+        # One of DAY, MONTH or YEAR to create a new partition automatically for every day/month/year, empty to disable
+        self.purchase_partition_interval = os.environ.get('PURCHASE_PARTITION_INTERVAL', '').upper()
+        # purchases dated before this go to the first (non interval) partition
+        self.purchase_partition_start = os.environ.get('PURCHASE_PARTITION_START', '2020-01-01')
+        # seconds purchase retention waits for in-flight DML on a partition before giving up on dropping it
+        self.ddl_lock_timeout = int(os.environ.get('DB_DDL_LOCK_TIMEOUT', 30))
+
+settings = None
+engine = None
+SessionLocal = sessionmaker(autocommit=False, autoflush=False)
+Base = declarative_base()
+
+def load_settings():
+    global settings
+    from dotenv import load_dotenv, find_dotenv
+    load_dotenv(find_dotenv())
+    settings = Settings()
+    return settings
+
+def load_oracle_driver():
+    if settings.db_driver == "oracledb":
+        import oracledb
+        if settings.oracledb_thick_mode:
+            oracledb.init_oracle_client(lib_dir=settings.oracle_client_lib_dir)
+        # SQLAlchemy 1.4 only has the cx_oracle dialect. python-oracledb has the same API, so it's registered under cx_Oracle's name
+        # (with a cx_Oracle version the dialect accepts)
+        oracledb.version = "8.3.0"
+        sys.modules["cx_Oracle"] = oracledb
+    elif settings.db_driver != "cx_oracle":
+        raise ValueError("DB_DRIVER must be oracledb or cx_oracle, got " + settings.db_driver)
+
+def oracle_url():
+    return URL(
+        "oracle+cx_oracle",
+        username=urllib.parse.quote_plus(str(os.environ.get('DB_USERNAME', 'DEFAULT_DB_USERNAME'))),
+        password=urllib.parse.quote_plus(str(os.environ.get('DB_PASSWORD', 'DEFAULT_DB_PASSWORD'))),
+        host=str(os.environ.get('DB_HOST', 'DEFAULT_DB_HOST')),
+        port=str(os.environ.get('DB_PORT', 'DEFAULT_DB_PORT')),
+        database=str(os.environ.get('DB_DATABASE', 'DEFAULT_DB_DATABASE')),
+    )
 
 # Azure SQL Server
 # connect_url = URL.create(
@@ -30,8 +84,39 @@ connect_url = URL(
 #     },
 # )
 
+def init_engine():
+    global engine
+    if engine is not None:
+        return engine
+    if settings is None:
+        load_settings()
 
-engine = create_engine(connect_url, max_identifier_length=128)
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
-Base = declarative_base()
+    connect_url = settings.db_url if settings.db_url else oracle_url()
+    engine_args = {"max_identifier_length": 128, "pool_size": settings.pool_size, "max_overflow": settings.max_overflow}
+    if str(connect_url).startswith("sqlite"):
+        engine_args.update(poolclass=QueuePool, connect_args={"check_same_thread": False})
+    else:
+        load_oracle_driver()
+        engine_args.update(arraysize=settings.arraysize)
+
+    engine = create_engine(connect_url, **engine_args)
+
+    if engine.dialect.name == "sqlite":
+        # SQLite ignores foreign keys unless asked, which would skip ON DELETE CASCADE and the parent key checks Oracle does
+        @event.listens_for(engine, "connect")
+        def enable_foreign_keys(dbapi_connection, connection_record):
+            cursor = dbapi_connection.cursor()
+            cursor.execute("PRAGMA foreign_keys=ON")
+            cursor.close()
+
+    if engine.dialect.name == "oracle":
+        @event.listens_for(engine, "connect")
+        def set_statement_cache_size(dbapi_connection, connection_record):
+            dbapi_connection.stmtcachesize = settings.stmt_cache_size
+
+        @event.listens_for(engine, "before_cursor_execute")
+        def set_prefetch_rows(conn, cursor, statement, parameters, context, executemany):
+            cursor.prefetchrows = settings.prefetch_rows
 
+    SessionLocal.configure(bind=engine)
+    return engine
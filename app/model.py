@@ -1,7 +1,42 @@
-from numbers import Number
-from sqlalchemy import Sequence, Boolean, Column, ForeignKey, Integer, String, Date, Float
+from sqlalchemy import Sequence, Boolean, Column, ForeignKey, Integer, String, Date, Float, Index
+from datetime import date
 from sqlalchemy.orm import relationship
-from .database import Base, engine
+from sqlalchemy.schema import CreateTable
+from sqlalchemy.ext.compiler import compiles
+from . import database
+from .database import Base
+
+PARTITION_INTERVALS = {
+    "DAY":   "NUMTODSINTERVAL(1, 'DAY')",
+    "MONTH": "NUMTOYMINTERVAL(1, 'MONTH')",
+    "YEAR":  "NUMTOYMINTERVAL(1, 'YEAR')",
+}
+
+# Oracle interval partitioning clause for the purchase table, None when partitioning is disabled.
+# Called when the DDL is compiled, since the settings are only loaded by the startup event
+def purchase_partition_by():
+    interval = database.settings.purchase_partition_interval
+    if not interval:
+        return None
+    if interval not in PARTITION_INTERVALS:
+        raise ValueError("PURCHASE_PARTITION_INTERVAL must be one of " + ", ".join(PARTITION_INTERVALS) + ", got " + interval)
+    start = date.fromisoformat(database.settings.purchase_partition_start)
+    # row movement lets an update of purchase_date move the row to another partition (ORA-14402 otherwise)
+    return ("PARTITION BY RANGE (purchase_date) INTERVAL (" + PARTITION_INTERVALS[interval] + ") "
+            "(PARTITION purchase_p_start VALUES LESS THAN (DATE '" + start.isoformat() + "')) "
+            "ENABLE ROW MOVEMENT")
+
+# appends table.info['oracle_partition_by'] (a function returning the clause) to CREATE TABLE on Oracle.
+# Other dialects (SQLite) get a plain table
+@compiles(CreateTable, "oracle")
+def create_partitioned_table(create, compiler, **kw):
+    ddl = compiler.visit_create_table(create, **kw)
+    partition_by = create.element.info.get('oracle_partition_by')
+    if partition_by:
+        partition_by = partition_by()
+    if partition_by:
+        ddl = ddl.rstrip() + "\n" + partition_by + "\n\n"
+    return ddl
 
 class LoyaltyLevel(Base):
     __tablename__ = "loyalty_level"
@@ -16,11 +51,14 @@ class LoyaltyLevel(Base):
 class Purchase(Base):
     __tablename__ = "purchase"
 #     __table_args__ = {'schema': 'db_schema_name'}
+    __table_args__ = {'info': {'oracle_partition_by': purchase_partition_by}}
     
     purchase_id         = Column(Integer, Sequence('purchase_id_seq'), primary_key=True)
     customer_id         = Column(Integer, ForeignKey('customer.customer_id', ondelete="CASCADE"), nullable=False)
     purchase_name       = Column(String(length=100))
-    purchase_date       = Column(Date) 
+    # partition key: a partitioned table can't store purchases without a date, so it defaults to today
+    purchase_date       = Column(Date, default=date.today) 
+    change_seq          = Column(Integer, index=True) # bumped by every crud write, drives the change feed
     # many-to-one
     customer            = relationship("Customer", back_populates="purchase")
 
@@ -34,8 +72,30 @@ class Customer(Base):
     date_of_birth   = Column(Date) 
     level_id        = Column(String(length=2), ForeignKey('loyalty_level.level_id'))
     signup_date     = Column(Date) 
+    change_seq      = Column(Integer, index=True) # bumped by every crud write, drives the change feed
     #one-to-one
     loyalty_level   = relationship("LoyaltyLevel", back_populates="customer", uselist=False)
     #one-to-many    
     purchase        = relationship("Purchase", back_populates="customer", cascade="all, delete", passive_deletes=True,)    
 
+
+# single row counter handing out change_seq values. Writers lock the row (UPDATE) until they commit,
+# so change_seq values become visible in the same order they were handed out and a change feed reader never skips one.
+# The price is that customer and purchase writes are serialised: a transaction holds the counter from its first
+# write until its commit, so a long /batch holds up every other writer for its whole duration (reads are not affected).
+# A database sequence would let writers run in parallel, but then the feed needs a watermark below every in-flight
+# transaction to avoid skipping late commits, which Oracle doesn't expose without DBA privileges
+class ChangeCounter(Base):
+    __tablename__ = "change_counter"
+
+    name            = Column(String(length=30), primary_key=True)
+    value           = Column(Integer, nullable=False, default=0)
+
+# deleted rows, so the change feed can tell downstream systems what to remove
+class ChangeTombstone(Base):
+    __tablename__ = "change_tombstone"
+    __table_args__ = (Index('ix_change_tombstone_table_seq', 'table_name', 'change_seq'),)
+
+    change_seq      = Column(Integer, primary_key=True, autoincrement=False)
+    table_name      = Column(String(length=30), nullable=False)
+    row_id          = Column(Integer, nullable=False)
@@ -1,66 +1,63 @@
-from ast import LtE, Num
-from typing import List, Optional
-from unicodedata import numeric
-from fastapi import Query
-from pydantic import BaseModel
+from typing import Any, Dict, List, Optional, Union
+from pydantic import BaseModel, Field, StrictInt, StrictStr, root_validator, validator
 from datetime import date
 
 class LoyaltyLevel(BaseModel):
 
-    level_id: str = Query(
+    level_id: str = Field(
         ...,
         title="Loyalty level ID",
         description="Loyalty level ID",
         max_length=2,
     )
-    description: Optional[str] = Query(
+    description: Optional[str] = Field(
         None,
         title="Loyalty level description",
         description="The description of the Loyalty level",
         max_length=100,
     )
-    discount: Optional[int] = Query(
+    discount: Optional[int] = Field(
         0,
         title="Loyalty discount percentage",
         description="Loyalty discount percentage",
-        lte=100
+        le=100
     )
 
     class Config:
         orm_mode = True
 
 class Customer(BaseModel):
-    customer_id: int = Query(                                         
+    customer_id: int = Field(                                         
         ...,                                                                    
         title="Customer ID",                                                    
         description="The ID of the customer",                                 
         gt=0,
 
     )
-    firstname: Optional[str] = Query(
+    firstname: Optional[str] = Field(
         None,
         title="Customer's first name",
         description="The first name of the customer",
         max_length=100,
     )
-    lastname: Optional[str] = Query(
+    lastname: Optional[str] = Field(
         None,
         title="Customer's last name",
         description="The last name of the customer",
         max_length=100,
     )
-    date_of_birth: Optional[date] = Query(
+    date_of_birth: Optional[date] = Field(
         None,
         title="Date of birth",
         description="Customer's date of birth",
     )
-    level_id: str = Query(
+    level_id: str = Field(
         ...,
         title="Loyalty level ID",
         description="Loyalty level ID",
         max_length=2,
     )
-    signup_date: Optional[date] = Query(
+    signup_date: Optional[date] = Field(
         None,
         title="Sign up date",
         description="Customer's sign up date",
@@ -72,30 +69,30 @@ class Customer(BaseModel):
 # a copy of the Customer model but without the customer_id. We create this for POST requests validation
 # this is done since we don't need to specify a the key (customer_id) whern creating a customer (since it's a sequence)
 class CustomerInput(BaseModel):
-    firstname: Optional[str] = Query(
+    firstname: Optional[str] = Field(
         None,
         title="Customer's first name",
         description="The first name of the customer",
         max_length=100,
     )
-    lastname: Optional[str] = Query(
+    lastname: Optional[str] = Field(
         None,
         title="Customer's last name",
         description="The last name of the customer",
         max_length=100,
     )
-    date_of_birth: Optional[date] = Query(
+    date_of_birth: Optional[date] = Field(
         None,
         title="Date of birth",
         description="Customer's date of birth",
     )
-    level_id: str = Query(
+    level_id: str = Field(
         ...,
         title="Loyalty level ID",
         description="Loyalty level ID",
         max_length=2,
     )
-    signup_date: Optional[date] = Query(
+    signup_date: Optional[date] = Field(
         None,
         title="Sign up date",
         description="Customer's sign up date",
@@ -105,25 +102,25 @@ class CustomerInput(BaseModel):
         orm_mode = True
 
 class Purchase(BaseModel):
-    purchase_id: int = Query(                                         
+    purchase_id: int = Field(                                         
         ...,                                                                    
         title="Purchase ID",                                                    
         description="The ID of the purchase",                                 
         gt=0,
     )
-    customer_id: int = Query(
+    customer_id: int = Field(
         ...,
         title="Customer ID FK",
         description="Customer ID FK",
         gt=0,
     )
-    purchase_name: Optional[str] = Query(
+    purchase_name: Optional[str] = Field(
         None,
         title="Purchase name",
         description="The name of the purchase",
         max_length=100,
     )
-    purchase_date: Optional[date] = Query(
+    purchase_date: Optional[date] = Field(
         None,
         title="Purchase date",
         description="The date of the purchase",
@@ -133,19 +130,19 @@ class Purchase(BaseModel):
         orm_mode = True
 
 class PurchaseInput(BaseModel):
-    customer_id: int = Query(
+    customer_id: int = Field(
         ...,
         title="Customer ID FK",
         description="Customer ID FK",
         gt=0,
     )
-    purchase_name: Optional[str] = Query(
+    purchase_name: Optional[str] = Field(
         None,
         title="Purchase name",
         description="The name of the purchase",
         max_length=100,
     )
-    purchase_date: Optional[date] = Query(
+    purchase_date: Optional[date] = Field(
         None,
         title="Purchase date",
         description="The date of the purchase",
@@ -154,3 +151,177 @@ class PurchaseInput(BaseModel):
     class Config:
         orm_mode = True
         
+
+class PurchaseRetention(BaseModel):
+    partitions_dropped: List[str] = Field(
+        [],
+        title="Dropped partitions",
+        description="Names of the purchase partitions dropped (partitioned Oracle table only)",
+    )
+    rows_deleted: int = Field(
+        0,
+        title="Deleted rows",
+        description="Number of purchases deleted row by row (the ones that were not in a dropped partition)",
+    )
+
+# -- Change feed --#
+
+class CustomerChange(BaseModel):
+    change_seq: int = Field(
+        ...,
+        title="Change sequence",
+        description="Position of this change in the change feed",
+    )
+    deleted: bool = Field(
+        False,
+        title="Deleted",
+        description="True if the customer was deleted (tombstone)",
+    )
+    customer_id: int = Field(
+        ...,
+        title="Customer ID",
+        description="The ID of the changed customer",
+    )
+    customer: Optional[Customer] = Field(
+        None,
+        title="Customer",
+        description="Current state of the customer, empty for deleted customers",
+    )
+
+class CustomerChanges(BaseModel):
+    changes: List[CustomerChange]
+    next_token: int = Field(
+        ...,
+        title="Next token",
+        description="Pass it as `since` to fetch the changes after this page",
+    )
+    has_more: bool = Field(
+        ...,
+        title="Has more",
+        description="True if there are more changes waiting after this page",
+    )
+
+class PurchaseChange(BaseModel):
+    change_seq: int = Field(
+        ...,
+        title="Change sequence",
+        description="Position of this change in the change feed",
+    )
+    deleted: bool = Field(
+        False,
+        title="Deleted",
+        description="True if the purchase was deleted (tombstone)",
+    )
+    purchase_id: int = Field(
+        ...,
+        title="Purchase ID",
+        description="The ID of the changed purchase",
+    )
+    purchase: Optional[Purchase] = Field(
+        None,
+        title="Purchase",
+        description="Current state of the purchase, empty for deleted purchases",
+    )
+
+class PurchaseChanges(BaseModel):
+    changes: List[PurchaseChange]
+    next_token: int = Field(
+        ...,
+        title="Next token",
+        description="Pass it as `since` to fetch the changes after this page",
+    )
+    has_more: bool = Field(
+        ...,
+        title="Has more",
+        description="True if there are more changes waiting after this page",
+    )
+
+# -- Batch --#
+
+class BatchOperation(BaseModel):
+    method: str = Field(
+        ...,
+        title="Method",
+        description="One of create, update or delete",
+        regex="^(create|update|delete)$",
+    )
+    resource: str = Field(
+        ...,
+        title="Resource",
+        description="One of customer, purchase or loyalty_level",
+        regex="^(customer|purchase|loyalty_level)$",
+    )
+    ref: Optional[str] = Field(
+        None,
+        title="Reference",
+        description="Name for the ID created by this operation. Later operations can use it as {\"$ref\": \"<name>\"} in place of an ID",
+        max_length=100,
+    )
+    id: Optional[Union[StrictInt, StrictStr, Dict[str, str]]] = Field(
+        None,
+        title="ID",
+        description="ID of the record to delete (delete only)",
+    )
+    data: Optional[Dict[str, Any]] = Field(
+        None,
+        title="Data",
+        description="The record, same as the body of the matching POST/PUT call (create and update only)",
+    )
+
+    @root_validator(skip_on_failure=True)
+    def check_method_fields(cls, values):
+        method, resource, id = values["method"], values["resource"], values["id"]
+        if method == "delete":
+            if id is None:
+                raise ValueError("id is required to delete a " + resource)
+        elif values["data"] is None:
+            raise ValueError("data is required to " + method + " a " + resource)
+        if isinstance(id, dict):
+            if list(id) != ["$ref"]:
+                raise ValueError("id must be an ID or {\"$ref\": \"<name>\"}")
+        elif id is not None:
+            # customers and purchases have sequence (integer) keys, loyalty levels string keys
+            key_type = str if resource == "loyalty_level" else int
+            if not isinstance(id, key_type):
+                raise ValueError("id of a " + resource + " must be " + ("a string" if key_type is str else "an integer"))
+        return values
+
+class BatchRequest(BaseModel):
+    operations: List[BatchOperation] = Field(
+        ...,
+        title="Operations",
+        description="Operations to run in order, in a single transaction",
+        min_items=1,
+        max_items=1000,
+    )
+
+    @validator("operations")
+    def check_unique_refs(cls, operations):
+        refs = [operation.ref for operation in operations if operation.ref]
+        for ref in refs:
+            if refs.count(ref) > 1:
+                raise ValueError("ref " + ref + " is used by more than one operation")
+        return operations
+
+class BatchResult(BaseModel):
+    index: int = Field(
+        ...,
+        title="Index",
+        description="Position of the operation in the request",
+    )
+    ref: Optional[str] = Field(
+        None,
+        title="Reference",
+        description="Reference name of the operation, if any",
+    )
+    status_code: int = Field(
+        ...,
+        title="Status code",
+        description="Status code the matching single call would have returned",
+    )
+    result: Dict[str, Any] = Field(
+        ...,
+        title="Result",
+        description="The created, updated or deleted record",
+    )
+
@@ -0,0 +1,160 @@
+import os, sys, json, time, argparse, statistics, subprocess
+
+# Compares the Oracle drivers (DB_DRIVER / ORACLEDB_THICK_MODE) on cold start and per-query latency.
+# Every driver runs in a fresh interpreter, so the startup numbers include importing the driver:
+#
+#   python benchmark.py                                  # oracledb thin vs oracledb thick vs cx_oracle
+#   python benchmark.py --drivers oracledb --queries 500
+#
+# Uses the same .env / DB_* variables as the app. The app tables must exist (start the app once).
+#
+# It also checks the worker boot import budget (python -X importtime -c "import main"), exiting with 1 when it's exceeded.
+# tests/test_import_time.py runs the same check against IMPORT_BUDGET:
+#
+#   python benchmark.py --import-budget               # IMPORT_BUDGET
+#   python benchmark.py --import-budget 0.3
+
+# frameworks every worker has to import anyway
+FRAMEWORKS = ("fastapi", "starlette", "pydantic", "sqlalchemy")
+
+# import time of main on top of the FRAMEWORKS, as a share of theirs (both from the same run, so it doesn't depend on
+# how fast or loaded the machine is). It's mostly the app's own modules: main (building the routes), schema, model...
+# Measured 0.25-0.32, best of 5. For scale, the frameworks take ~300-400 ms on a single CPU box and importing
+# requests alone would add ~0.3
+IMPORT_BUDGET = 0.4
+
+# modules importing main must not load: they belong to the startup event (dotenv, the Oracle drivers), are only
+# loaded when enabled (brotli, zstandard), or aren't used at all (requests)
+LAZY_MODULES = ("requests", "dotenv", "oracledb", "cx_Oracle", "brotli", "zstandard")
+
+DRIVERS = {
+    "oracledb":       {"DB_DRIVER": "oracledb", "ORACLEDB_THICK_MODE": "false"},
+    "oracledb-thick": {"DB_DRIVER": "oracledb", "ORACLEDB_THICK_MODE": "true"},
+    "cx_oracle":      {"DB_DRIVER": "cx_oracle"},
+}
+
+def worker(queries: int):
+    started = time.perf_counter()
+    from sqlalchemy import text
+    from app import database, crud
+    database.load_settings()
+    database.init_engine()
+    imported = time.perf_counter()
+    with database.engine.connect() as connection:
+        connection.exec_driver_sql("SELECT 1 FROM dual").scalar()
+    connected = time.perf_counter()
+
+    db = database.SessionLocal()
+    workload = {
+        "select 1 from dual": lambda: db.execute(text("SELECT 1 FROM dual")).scalar(),
+        "get_customer": lambda: crud.get_customer(db, 1),
+        "get_customers": lambda: crud.get_customers(db),
+        "get_purchases": lambda: crud.get_purchases(db),
+    }
+    timings = {}
+    for name, query in workload.items():
+        samples = []
+        for _ in range(queries):
+            query_started = time.perf_counter()
+            query()
+            samples.append((time.perf_counter() - query_started) * 1000)
+            db.expunge_all()
+        samples.sort()
+        timings[name] = {
+            "mean_ms": statistics.mean(samples),
+            "p50_ms": samples[len(samples) // 2],
+            "p95_ms": samples[int(len(samples) * 0.95) - 1],
+        }
+    db.close()
+
+    print(json.dumps({
+        "import_s": imported - started,
+        "first_query_s": connected - imported,
+        "startup_s": connected - started,
+        "queries": timings,
+    }))
+
+def run(drivers: list, queries: int):
+    results = {}
+    for driver in drivers:
+        env = dict(os.environ, **DRIVERS[driver])
+        process = subprocess.run([sys.executable, __file__, "--worker", "--queries", str(queries)], env=env, capture_output=True, text=True)
+        if process.returncode != 0:
+            errors = [line for line in process.stderr.splitlines() if "Error" in line] or process.stderr.strip().splitlines()
+            print(driver + ": failed, " + errors[-1].strip())
+            continue
+        results[driver] = json.loads(process.stdout.strip().splitlines()[-1])
+
+    if not results:
+        return
+    print("\nStartup (seconds)")
+    print("{:<16} {:>10} {:>13} {:>10}".format("driver", "import", "first query", "total"))
+    for driver, result in results.items():
+        print("{:<16} {:>10.3f} {:>13.3f} {:>10.3f}".format(driver, result["import_s"], result["first_query_s"], result["startup_s"]))
+
+    print("\nPer query (milliseconds, " + str(queries) + " runs each)")
+    print("{:<20} {:<16} {:>9} {:>9} {:>9}".format("query", "driver", "mean", "p50", "p95"))
+    for name in next(iter(results.values()))["queries"]:
+        for driver, result in results.items():
+            timing = result["queries"][name]
+            print("{:<20} {:<16} {:>9.3f} {:>9.3f} {:>9.3f}".format(name, driver, timing["mean_ms"], timing["p50_ms"], timing["p95_ms"]))
+
+# cumulative import time of `module` in microseconds, and the slowest imports under it
+def measure_import_time(module: str):
+    process = subprocess.run([sys.executable, "-X", "importtime", "-c", "import " + module], capture_output=True, text=True,
+                             cwd=os.path.dirname(os.path.abspath(__file__)))
+    if process.returncode != 0:
+        raise RuntimeError("import " + module + " failed:\n" + process.stderr.strip().splitlines()[-1])
+    imports = []  # (depth, cumulative, name), every module is listed after the ones it imported
+    for line in process.stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line or "self [us]" in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        imports.append(((len(name) - len(name.lstrip())) // 2, int(cumulative), name.strip()))
+    total = next(cumulative for _, cumulative, name in reversed(imports) if name == module)
+
+    def is_framework(name):
+        return name.split(".")[0] in FRAMEWORKS
+    frameworks = 0
+    for i, (depth, cumulative, name) in enumerate(imports):
+        parent = next((other for other in imports[i + 1:] if other[0] < depth), None)
+        # only the outermost framework imports, their cumulative time covers everything they import
+        if is_framework(name) and not (parent and is_framework(parent[2])):
+            frameworks += cumulative
+    slowest = sorted(((cumulative, name) for _, cumulative, name in imports), reverse=True)[1:11]
+    return (total - frameworks) / frameworks, total, frameworks, slowest
+
+# the LAZY_MODULES loaded by importing `module` (in a fresh interpreter)
+def eagerly_imported(module: str):
+    process = subprocess.run([sys.executable, "-c", "import sys, " + module + "; print(' '.join(sorted(sys.modules)))"],
+                             capture_output=True, text=True, cwd=os.path.dirname(os.path.abspath(__file__)))
+    if process.returncode != 0:
+        raise RuntimeError("import " + module + " failed:\n" + process.stderr.strip().splitlines()[-1])
+    return [name for name in LAZY_MODULES if name in process.stdout.split()]
+
+def check_import_budget(budget: float = IMPORT_BUDGET, module: str = "main", runs: int = 5):
+    share, total, frameworks, slowest = min(measure_import_time(module) for _ in range(runs))
+    print("import " + module + ": {:.1f} ms, {:.1f} ms of it in {}: {:.2f} on top (budget {:.2f})".format(
+        total / 1000, frameworks / 1000, ", ".join(FRAMEWORKS), share, budget))
+    for cumulative, name in slowest:
+        print("  {:>8.1f} ms  {}".format(cumulative / 1000, name))
+    eager = eagerly_imported(module)
+    if eager:
+        print("  imported too early: " + ", ".join(eager))
+    return share <= budget and not eager
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare Oracle driver startup time and query latency")
+    parser.add_argument("--drivers", nargs="+", choices=list(DRIVERS), default=list(DRIVERS))
+    parser.add_argument("--queries", type=int, default=200, help="runs per query")
+    parser.add_argument("--import-budget", type=float, nargs="?", const=IMPORT_BUDGET, metavar="SHARE",
+                        help="only check that importing main adds at most SHARE of the frameworks' import time (default " + str(IMPORT_BUDGET) + ")")
+    parser.add_argument("--worker", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.import_budget:
+        sys.exit(0 if check_import_budget(args.import_budget) else 1)
+    elif args.worker:
+        worker(args.queries)
+    else:
+        run(args.drivers, args.queries)
@@ -1,22 +1,22 @@
-import os, secrets, requests, json
 from typing import List, Optional
+from datetime import date
 
-from fastapi import Depends, FastAPI, HTTPException, Response, status, Path
-from fastapi.security import HTTPBasic, HTTPBasicCredentials
-from starlette.status import HTTP_404_NOT_FOUND, HTTP_401_UNAUTHORIZED, HTTP_503_SERVICE_UNAVAILABLE
+from fastapi import Depends, FastAPI, HTTPException, Response, status, Path, Query
+from starlette.status import HTTP_404_NOT_FOUND
 
 from sqlalchemy.orm import Session 
-from sqlalchemy import MetaData, inspect
+from sqlalchemy import inspect, exc
 from sqlalchemy.sql import func
 
-from app import model, schema, crud
-from app.database import SessionLocal, engine
-
-from dotenv import load_dotenv, find_dotenv
+from app import model, schema, crud, admission, batch, counts, compression, database
+from app.database import SessionLocal
 
+# importing this module only builds the app and its routes. The settings, the database engine (and the Oracle driver)
+# are loaded by the startup event
 app = FastAPI()
+app.add_middleware(compression.CompressionMiddleware)
 
-#security = HTTPBasic()
+#security = HTTPBasic()  # from fastapi.security import HTTPBasic, HTTPBasicCredentials
 
 def get_db():
     db = SessionLocal()
@@ -30,6 +30,12 @@ async def start(
         db:   Session = Depends(get_db)
     ):
     print("Starting up...")
+    # settings (and the .env file) are only read now, not when main is imported
+    database.load_settings()
+    admission.init_limiter()
+    counts.init_cache()
+    compression.init_compression()
+    engine = database.init_engine()
     inspector = inspect(engine)
     # check if we created the tables in the database already. If not, create and populate them
     if not inspector.has_table('customer'):
@@ -37,16 +43,19 @@ async def start(
         model.LoyaltyLevel.metadata.create_all(engine)
         model.Customer.metadata.create_all(engine)
         model.Purchase.metadata.create_all(engine)
+        model.ChangeTombstone.metadata.create_all(engine)
 
         #populate the tables with test data
         print("Populating the tables in the database")
         session = Session(engine)
+        session.add(model.ChangeCounter(name=crud.CHANGE_COUNTER, value=0))
+        session.flush()
         loyalty_level_instance_1 = model.LoyaltyLevel(level_id="pl", description='Platinum', discount=25)
         loyalty_level_instance_2 = model.LoyaltyLevel(level_id="gl", description='Gold', discount=15)
         session.add_all([loyalty_level_instance_1, loyalty_level_instance_2])
         
-        customer_instance = model.Customer(firstname='John', lastname='Doe', date_of_birth=func.now(), level_id=loyalty_level_instance_1.level_id,  signup_date=func.now())
-        purchase_instance = model.Purchase(customer = customer_instance, purchase_name="something")
+        customer_instance = model.Customer(firstname='John', lastname='Doe', date_of_birth=func.now(), level_id=loyalty_level_instance_1.level_id,  signup_date=func.now(), change_seq=crud.next_change_seq(session))
+        purchase_instance = model.Purchase(customer = customer_instance, purchase_name="something", change_seq=crud.next_change_seq(session))
         session.add_all([purchase_instance])
         session.commit()
     else:   
@@ -55,14 +64,16 @@ async def start(
 @app.on_event("shutdown")
 async def shutdown(db:   Session = Depends(get_db)):
         print("Shutting down...")
+        engine = database.engine
         print("Dropping tables")
         model.LoyaltyLevel.metadata.drop_all(engine)
         model.Customer.metadata.drop_all(engine)
         model.Purchase.metadata.drop_all(engine)
+        model.ChangeTombstone.metadata.drop_all(engine)
         print("Tables dropped")
        
     
-# # authentication piece (we don't use it in this example)
+# # authentication piece (we don't use it in this example, needs `import secrets`)
 # def is_authenticated(credentials: HTTPBasicCredentials = Depends(security)):
 #     correct_username = secrets.compare_digest(credentials.username, "someusername")
 #     correct_password = secrets.compare_digest(credentials.password, "somepassword")
@@ -79,11 +90,21 @@ async def shutdown(db:   Session = Depends(get_db)):
 def read_root():
     return {"Hello": "World"}
 
+@app.get(
+    "/metrics",
+    tags=["Metrics"],
+    summary="Gets the service metrics",
+    response_description="Admission control counters (admitted, queued and shed requests) and response compression counters"
+)
+def get_metrics():
+    return {"admission": admission.limiter.stats(), "compression": compression.metrics.stats()}
+
 # -- Customer --#
 
 @app.get(
     "/customers",
     tags=["Customers"],
+    dependencies=[Depends(admission.export)],
     response_model=List[schema.Customer],
     response_model_exclude={"date_of_birth"}, # in case we need to exclude a field from response
     # response_model_exclude_none=True  # usefull if response json is too big and we want to hide nulls to make it smaller
@@ -91,14 +112,44 @@ def read_root():
     response_description="A list containing all the customers"
 )
 def get_customers(
+        response: Response,
+        count: str = Query("none", title="Total count", description="Return the total count in the X-Total-Count header: exact, estimate (from the table statistics) or none", regex="^(exact|estimate|none)$"),
         db:   Session = Depends(get_db)
         #,auth: bool    = Depends(is_authenticated)
     ):
+    total = counts.total_count(db, count, model.Customer.__tablename__, lambda: crud.count_customers(db))
+    if total is not None:
+        response.headers[counts.COUNT_HEADER] = str(total)
     return crud.get_customers(db)
 
+@app.get(
+    "/customers/changes",
+    tags=["Customers"],
+    dependencies=[Depends(admission.read)],
+    response_model=schema.CustomerChanges,
+    summary="Gets the customers inserted, updated or deleted since the given token",
+    response_description="A page of customer changes in order, with the token to resume from"
+)
+def get_customer_changes(
+        since: int = Query(0, title="Since", description="next_token of the previous page, 0 to start from the beginning", ge=0),
+        limit: int = Query(100, title="Limit", description="Maximum number of changes to return", gt=0, le=1000),
+        db:   Session = Depends(get_db)
+        #,auth: bool    = Depends(is_authenticated)
+    ):
+    changes, has_more = crud.get_customer_changes(db, since, limit)
+    return {
+        "changes": [
+            {"change_seq": change_seq, "deleted": row is None, "customer_id": customer_id, "customer": row}
+            for change_seq, customer_id, row in changes
+        ],
+        "next_token": changes[-1][0] if changes else since,
+        "has_more": has_more,
+    }
+
 @app.get(
     "/customer/{customer_id}",
     tags=["Customers"], # a way to group api calls in the docs page
+    dependencies=[Depends(admission.read)],
     response_model=List[schema.Customer],
     summary="Gets a single customer based on customer_id",
     response_description="A single customer based on the provided ID",
@@ -129,6 +180,7 @@ def get_customer(customer_id: int = Path(
 
 @app.post("/customer/", 
         tags=["Customers"], # a way to group api calls in the docs page
+        dependencies=[Depends(admission.write)],
         response_model=schema.CustomerInput, 
         summary="Create a customer",
         response_description="Newly created customer",
@@ -146,6 +198,7 @@ def create_customer(customer: schema.CustomerInput,
 
 @app.put("/customer/", 
         tags=["Customers"],
+        dependencies=[Depends(admission.write)],
         response_model=schema.Customer, 
         summary="Update a single customer",
         response_description="Updated the customer",
@@ -171,6 +224,7 @@ def update_customer(customer: schema.Customer,
 
 @app.delete("/customer/{customer_id}", 
         tags=["Customers"],
+        dependencies=[Depends(admission.write)],
         response_model=schema.Customer, 
         summary="Delete a single customer based customer_id - cascading (all associated records will be deleted)",
         response_description="Deleted the customer and all the associated records",
@@ -202,20 +256,54 @@ def delete_customer(customer_id: int = Path(
 @app.get(
     "/purchases",
     tags=["Purchases"],
+    dependencies=[Depends(admission.export)],
     response_model=List[schema.Purchase],
-    summary="Gets all purchases",
+    summary="Gets all purchases, optionally only the ones made between two dates",
     response_description="A list containing all the purchases"
 )
 def get_purchases(
+        response: Response,
+        date_from: Optional[date] = Query(None, title="From date", description="Only purchases made on or after this date"),
+        date_to: Optional[date] = Query(None, title="To date", description="Only purchases made on or before this date"),
+        count: str = Query("none", title="Total count", description="Return the total count in the X-Total-Count header: exact, estimate (from the table statistics) or none", regex="^(exact|estimate|none)$"),
         db:   Session = Depends(get_db)
         #,auth: bool    = Depends(is_authenticated)
     ):
-    return crud.get_purchases(db)
+    total = counts.total_count(db, count, model.Purchase.__tablename__, lambda: crud.count_purchases(db, date_from, date_to), date_from, date_to)
+    if total is not None:
+        response.headers[counts.COUNT_HEADER] = str(total)
+    return crud.get_purchases(db, date_from, date_to)
+
+# has to be declared before /purchases/{customer_id}, otherwise "changes" is matched as a customer_id
+@app.get(
+    "/purchases/changes",
+    tags=["Purchases"],
+    dependencies=[Depends(admission.read)],
+    response_model=schema.PurchaseChanges,
+    summary="Gets the purchases inserted, updated or deleted since the given token",
+    response_description="A page of purchase changes in order, with the token to resume from"
+)
+def get_purchase_changes(
+        since: int = Query(0, title="Since", description="next_token of the previous page, 0 to start from the beginning", ge=0),
+        limit: int = Query(100, title="Limit", description="Maximum number of changes to return", gt=0, le=1000),
+        db:   Session = Depends(get_db)
+        #,auth: bool    = Depends(is_authenticated)
+    ):
+    changes, has_more = crud.get_purchase_changes(db, since, limit)
+    return {
+        "changes": [
+            {"change_seq": change_seq, "deleted": row is None, "purchase_id": purchase_id, "purchase": row}
+            for change_seq, purchase_id, row in changes
+        ],
+        "next_token": changes[-1][0] if changes else since,
+        "has_more": has_more,
+    }
 
 
 @app.get(
     "/purchase/{purchase_id}",
     tags=["Purchases"],
+    dependencies=[Depends(admission.read)],
     response_model=List[schema.Purchase],
     summary="Gets a single purchase based on purchase_id",
     response_description="A single purchase based on the provided ID",
@@ -246,6 +334,7 @@ def get_purchase(purchase_id: int = Path(
 @app.get(
     "/purchases/{customer_id}",
     tags=["Purchases"],
+    dependencies=[Depends(admission.read)],
     response_model=List[schema.Purchase],
     summary="Gets a list of purchases based on customer_id",
     response_description="A list of purchases based on the provided ID",
@@ -275,6 +364,7 @@ def get_purchase(customer_id: int = Path(
 
 @app.post("/purchases/", 
         tags=["Purchases"], # a way to group api calls in the docs page
+        dependencies=[Depends(admission.write)],
         response_model=schema.Purchase, 
         summary="Create a purchase",
         response_description="Newly created purchase",
@@ -298,6 +388,7 @@ def create_purchase(purchase: schema.PurchaseInput,
 
 @app.put("/purchase/", 
         tags=["Purchases"],
+        dependencies=[Depends(admission.write)],
         response_model=schema.Purchase, 
         summary="Update a single purchase",
         response_description="Updated the purchase",
@@ -321,6 +412,7 @@ def update_purchase(purchase: schema.Purchase,
 
 @app.delete("/purchase/{purchase_id}", 
         tags=["Purchases"],
+        dependencies=[Depends(admission.write)],
         response_model=schema.Purchase, 
         summary="Delete a single purchase based on card_id",
         response_description="Deleted a single purchase based on card_id",
@@ -347,24 +439,55 @@ def delete_purchase(purchase_id: int = Path(
                 headers={"X-Error": "Some error goes here"},
             )
 
+@app.delete("/purchases/retention", 
+        tags=["Purchases"],
+        dependencies=[Depends(admission.write)],
+        response_model=schema.PurchaseRetention, 
+        summary="Delete all purchases made before the given date",
+        response_description="Dropped purchase partitions (partitioned Oracle table) and number of purchases deleted row by row",
+        responses={503: {"model": None, "description": "A partition is still in use by other sessions, retry later"}},
+        status_code = status.HTTP_200_OK
+        )
+def drop_purchases_before(before: date = Query(..., title="Before date", description="Purchases made before this date are deleted"),
+                db:   Session = Depends(get_db)
+                #,auth: bool    = Depends(is_authenticated)
+                ):
+    try:
+        return crud.drop_purchases_before(db, before)
+    except exc.DBAPIError as e:
+        # a partition could not be dropped (usually still locked by other sessions after DB_DDL_LOCK_TIMEOUT).
+        # The partitions before it are gone, the rest is untouched, so the call can simply be repeated
+        raise HTTPException(
+            status_code=503,
+            detail="Could not drop the purchase partitions, try again later: " + str(e.orig),
+            headers={"Retry-After": "60"},
+        )
+
 # -- LoyaltyLevel --#
 
 @app.get(
     "/loyalty_levels",
     tags=["LoyaltyLevels"],
+    dependencies=[Depends(admission.read)],
     response_model=List[schema.LoyaltyLevel],
     summary="Gets all loyalty levels",
     response_description="A list containing all the loyalty levels"
 )
 def get_loyalty_levels(
+        response: Response,
+        count: str = Query("none", title="Total count", description="Return the total count in the X-Total-Count header: exact, estimate (from the table statistics) or none", regex="^(exact|estimate|none)$"),
         db:   Session = Depends(get_db)
         #,auth: bool    = Depends(is_authenticated)
     ):
+    total = counts.total_count(db, count, model.LoyaltyLevel.__tablename__, lambda: crud.count_loyalty_levels(db))
+    if total is not None:
+        response.headers[counts.COUNT_HEADER] = str(total)
     return crud.get_loyalty_levels(db)
 
 @app.get(
     "/loyalty_level/{level_id}",
     tags=["LoyaltyLevels"], 
+    dependencies=[Depends(admission.read)],
     response_model=List[schema.LoyaltyLevel],
     summary="Gets a single loyalty level based on level_id",
     response_description="A single loyalty level based on the provided ID",
@@ -393,6 +516,7 @@ def get_loyalty_level(level_id: str = Path(
 
 @app.post("/loyalty_level/", 
         tags=["LoyaltyLevels"], 
+        dependencies=[Depends(admission.write)],
         response_model=schema.LoyaltyLevel, 
         summary="Create a loyalty level",
         response_description="Newly created loyalty level",
@@ -408,6 +532,7 @@ def create_loyalty_level(loyalty_level: schema.LoyaltyLevel,
 
 @app.put("/loyalty_level/", 
         tags=["LoyaltyLevels"],
+        dependencies=[Depends(admission.write)],
         response_model=schema.LoyaltyLevel, 
         summary="Update a single loyalty level",
         response_description="Updated the loyalty level",
@@ -433,6 +558,7 @@ def update_loyalty_level(loyalty_level: schema.LoyaltyLevel,
 
 @app.delete("/loyalty_level/{level_id}", 
         tags=["LoyaltyLevels"],
+        dependencies=[Depends(admission.write)],
         response_model=schema.LoyaltyLevel, 
         summary="Delete a single loyalty level based level_id",
         response_description="Deleted the loyalty level",
@@ -459,3 +585,36 @@ def delete_loyalty_level(level_id: str = Path(
                 headers={"X-Error": "Some error goes here"},
             )
 
+# -- Batch --#
+
+@app.post("/batch", 
+        tags=["Batch"],
+        dependencies=[Depends(admission.write)],
+        response_model=List[schema.BatchResult], 
+        summary="Run many create/update/delete operations in a single request and transaction",
+        response_description="The result of every operation, in the order they were sent",
+        responses={404: {"model": None, "description": "An operation updates or deletes a record that doesn't exist, nothing was changed"},
+                   409: {"model": None, "description": "An operation violates an integrity constraint (unknown parent key, duplicate key, record still referenced), nothing was changed"},
+                   422: {"model": None, "description": "An operation is not valid, nothing was changed"}},
+        status_code = status.HTTP_200_OK
+        )
+def run_batch(request: schema.BatchRequest,
+                    db:   Session = Depends(get_db),
+                    #,auth: bool    = Depends(is_authenticated)
+                    ):
+    """
+    Operations are run in order and committed together. If one of them fails, none of them is applied
+    and the error tells which one failed. An operation can use an ID created by an earlier one with {"$ref": "<name>"}:
+
+        {"operations": [
+            {"method": "create", "resource": "customer", "ref": "john", "data": {"firstname": "John", "level_id": "gl"}},
+            {"method": "create", "resource": "purchase", "data": {"customer_id": {"$ref": "john"}, "purchase_name": "something"}}
+        ]}
+    """
+    try:
+        return batch.run_batch(db, request.operations)
+    except batch.BatchError as e:
+        raise HTTPException(
+            status_code=e.status_code,
+            detail={"index": e.index, "detail": e.detail},
+        )
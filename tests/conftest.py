@@ -0,0 +1,19 @@
+import os, sys
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# the API tests run on the SQLite fallback (DB_URL). The startup event creates and populates the tables,
+# the shutdown event drops them, so every test starts from the sample data
+@pytest.fixture(scope="session")
+def db_url(tmp_path_factory):
+    url = "sqlite:///" + str(tmp_path_factory.mktemp("db") / "test.db")
+    os.environ["DB_URL"] = url
+    return url
+
+@pytest.fixture
+def client(db_url):
+    from fastapi.testclient import TestClient
+    import main
+    with TestClient(main.app) as client:
+        yield client
@@ -0,0 +1,112 @@
+import asyncio
+import pytest
+from fastapi import HTTPException
+from app.admission import AdmissionLimiter
+
+def limiter(limit=1, queue_size=2, queue_timeout=1.0, export_share=0.5):
+    return AdmissionLimiter(limit=limit, queue_size=queue_size, queue_timeout=queue_timeout, retry_after=3, export_share=export_share)
+
+# lets the background acquire() calls run until they wait (or finish)
+async def settle():
+    for _ in range(5):
+        await asyncio.sleep(0)
+
+# starts acquire() for `priority` in the background and lets it reach the queue
+async def waiting(limiter, priority):
+    task = asyncio.ensure_future(limiter.acquire(priority))
+    await settle()
+    return task
+
+def test_admits_up_to_the_limit():
+    async def run():
+        admission = limiter(limit=2)
+        await admission.acquire("read")
+        await admission.acquire("write")
+        assert admission.stats()["in_flight"] == 2
+        admission.release("read")
+        admission.release("write")
+        assert admission.stats()["in_flight"] == 0
+    asyncio.run(run())
+
+def test_queued_requests_are_served_by_priority():
+    async def run():
+        admission = limiter(limit=1, queue_size=10)
+        await admission.acquire("read")
+        export = await waiting(admission, "export")
+        read = await waiting(admission, "read")
+        write = await waiting(admission, "write")
+
+        admission.release("read")
+        await settle()
+        assert write.done() and not read.done() and not export.done()
+        admission.release("write")
+        await settle()
+        assert read.done() and not export.done()
+        admission.release("read")
+        await settle()
+        assert export.done()
+        assert admission.stats()["queued"] == {"write": 1, "read": 1, "export": 1}
+    asyncio.run(run())
+
+def test_exports_only_get_their_share():
+    async def run():
+        admission = limiter(limit=2, export_share=0.5)
+        await admission.acquire("export")
+        export = await waiting(admission, "export")
+        await admission.acquire("read")
+        assert not export.done()
+        export.cancel()
+    asyncio.run(run())
+
+def test_full_queue_sheds_with_503_and_retry_after():
+    async def run():
+        admission = limiter(limit=1, queue_size=1)
+        await admission.acquire("read")
+        queued = await waiting(admission, "read")
+        with pytest.raises(HTTPException) as error:
+            await admission.acquire("read")
+        assert error.value.status_code == 503
+        assert error.value.headers == {"Retry-After": "3"}
+        assert admission.stats()["shed"]["read"]["queue_full"] == 1
+        queued.cancel()
+    asyncio.run(run())
+
+def test_full_queue_evicts_the_newest_lower_priority_waiter():
+    async def run():
+        admission = limiter(limit=1, queue_size=2)
+        await admission.acquire("write")
+        first_export = await waiting(admission, "export")
+        second_export = await waiting(admission, "export")
+
+        write = await waiting(admission, "write")
+        assert second_export.done() and not first_export.done()
+        with pytest.raises(HTTPException) as error:
+            second_export.result()
+        assert error.value.status_code == 503
+        assert admission.stats()["shed"]["export"]["queue_full"] == 1
+
+        admission.release("write")
+        await settle()
+        assert write.done() and not first_export.done()
+        first_export.cancel()
+    asyncio.run(run())
+
+def test_waiting_too_long_is_shed():
+    async def run():
+        admission = limiter(limit=1, queue_timeout=0.01)
+        await admission.acquire("read")
+        with pytest.raises(HTTPException) as error:
+            await admission.acquire("read")
+        assert error.value.status_code == 503
+        stats = admission.stats()
+        assert stats["shed"]["read"]["timeout"] == 1 and stats["waiting"] == 0
+    asyncio.run(run())
+
+def test_overloaded_route_returns_503(client):
+    from app import admission
+    admission.limiter.limit = 0
+    admission.limiter.queue_size = 0
+    response = client.get("/customers")
+    assert response.status_code == 503
+    assert response.headers["Retry-After"] == "1"
+    assert client.get("/metrics").json()["admission"]["shed_total"] == 1
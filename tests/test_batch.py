@@ -0,0 +1,93 @@
+import warnings
+from sqlalchemy import event
+from app import database
+
+# the sample data is loyalty levels pl and gl, customer 1 and purchase 1
+
+def run_batch(client, *operations):
+    return client.post("/batch", json={"operations": list(operations)})
+
+def create(resource, data, ref=None):
+    return {"method": "create", "resource": resource, "data": data, "ref": ref}
+
+def test_refs_and_results(client):
+    response = run_batch(client,
+        create("customer", {"firstname": "John", "level_id": "gl"}, ref="john"),
+        create("purchase", {"customer_id": {"$ref": "john"}, "purchase_name": "first"}),
+        create("purchase", {"customer_id": {"$ref": "john"}, "purchase_name": "second"}),
+        {"method": "update", "resource": "customer", "data": {"customer_id": {"$ref": "john"}, "firstname": "Johnny", "level_id": "pl"}},
+        {"method": "delete", "resource": "purchase", "id": 1},
+    )
+    assert response.status_code == 200
+    results = response.json()
+    assert [(result["index"], result["status_code"]) for result in results] == [(0, 201), (1, 201), (2, 201), (3, 200), (4, 200)]
+    assert results[0]["ref"] == "john" and results[0]["result"]["customer_id"] == 2
+    assert [result["result"]["customer_id"] for result in results[1:3]] == [2, 2]
+    assert client.get("/customer/2").json()[0]["firstname"] == "Johnny"
+    assert [purchase["purchase_name"] for purchase in client.get("/purchases/2").json()] == ["first", "second"]
+    assert client.get("/purchase/1").status_code == 404
+
+def test_grouped_creates_are_one_insert(client):
+    statements = []
+    def record(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement.split()[0] + (" (executemany)" if executemany else ""))
+    event.listen(database.engine, "before_cursor_execute", record)
+    try:
+        response = run_batch(client, *[create("purchase", {"customer_id": 1, "purchase_name": str(i)}) for i in range(5)])
+    finally:
+        event.remove(database.engine, "before_cursor_execute", record)
+    assert response.status_code == 200
+    assert statements.count("INSERT (executemany)") == 1
+    assert "INSERT" not in statements
+    # one change counter reservation for the whole group
+    assert statements.count("UPDATE") == 1
+
+def test_missing_record_is_404_and_nothing_is_applied(client):
+    response = run_batch(client,
+        create("loyalty_level", {"level_id": "sv", "description": "Silver"}),
+        {"method": "delete", "resource": "customer", "id": 1},
+        {"method": "delete", "resource": "customer", "id": 99},
+    )
+    assert response.status_code == 404
+    assert response.json()["detail"]["index"] == 2
+    assert client.get("/loyalty_level/sv").status_code == 404
+    assert client.get("/customer/1").status_code == 200
+
+def test_constraint_violation_is_409_for_the_failing_operation(client):
+    response = run_batch(client, *[create("purchase", {"customer_id": customer_id}) for customer_id in (1, 1, 999, 1)])
+    assert response.status_code == 409
+    assert response.json()["detail"]["index"] == 2
+    assert len(client.get("/purchases").json()) == 1
+
+    response = run_batch(client, create("customer", {"level_id": "gl"}), create("customer", {"level_id": "zz"}))
+    assert (response.status_code, response.json()["detail"]["index"]) == (409, 1)
+
+    response = run_batch(client, {"method": "delete", "resource": "loyalty_level", "id": "pl"})
+    assert (response.status_code, response.json()["detail"]["index"]) == (409, 0)
+
+def test_invalid_operations_are_422(client):
+    invalid = [
+        [{"method": "delete", "resource": "customer"}],
+        [{"method": "delete", "resource": "customer", "id": "abc"}],
+        [{"method": "delete", "resource": "loyalty_level", "id": 5}],
+        [{"method": "delete", "resource": "customer", "id": {"name": "john"}}],
+        [{"method": "create", "resource": "customer"}],
+        [{"method": "update", "resource": "purchase"}],
+        [create("loyalty_level", {"level_id": "a1"}, ref="x"), create("loyalty_level", {"level_id": "a2"}, ref="x")],
+        [create("purchase", {"customer_id": {"$ref": "nobody"}})],
+        [create("customer", {"level_id": "toolong"})],
+    ]
+    for operations in invalid:
+        assert run_batch(client, *operations).status_code == 422, operations
+    assert client.get("/loyalty_level/a1").status_code == 404
+
+def test_recreating_a_deleted_record(client):
+    with warnings.catch_warnings():
+        warnings.simplefilter("error")
+        response = run_batch(client,
+            create("loyalty_level", {"level_id": "br", "description": "Bronze"}),
+            {"method": "delete", "resource": "loyalty_level", "id": "br"},
+            create("loyalty_level", {"level_id": "br", "description": "Bronze again"}),
+        )
+    assert response.status_code == 200
+    assert client.get("/loyalty_level/br").json()[0]["description"] == "Bronze again"
@@ -0,0 +1,53 @@
+# the sample data is customer 1 (change_seq 1) with purchase 1 (change_seq 2)
+
+def read_feed(client, path, limit):
+    changes, since, pages = [], 0, 0
+    while True:
+        page = client.get(path, params={"since": since, "limit": limit}).json()
+        changes += page["changes"]
+        since = page["next_token"]
+        pages += 1
+        if not page["has_more"]:
+            return changes, pages
+
+def test_feed_pages_through_inserts_updates_and_deletes(client):
+    for name in ("A", "B", "C"):
+        assert client.post("/customer/", json={"firstname": name, "level_id": "gl"}).status_code == 201
+    assert client.put("/customer/", json={"customer_id": 2, "firstname": "A2", "level_id": "pl"}).status_code == 200
+    assert client.delete("/customer/3").status_code == 200
+
+    changes, pages = read_feed(client, "/customers/changes", limit=2)
+    assert pages == 2
+    assert [(change["customer_id"], change["deleted"]) for change in changes] == [(1, False), (4, False), (2, False), (3, True)]
+    seqs = [change["change_seq"] for change in changes]
+    assert seqs == sorted(seqs) and len(set(seqs)) == len(seqs)
+    # an updated customer shows up once, in its current state
+    assert changes[2]["customer"]["firstname"] == "A2"
+    assert changes[3]["customer"] is None
+
+def test_feed_resumes_from_the_token(client):
+    page = client.get("/customers/changes", params={"since": 0, "limit": 1}).json()
+    assert page["has_more"] is False and len(page["changes"]) == 1
+
+    client.post("/customer/", json={"firstname": "New", "level_id": "gl"})
+    page = client.get("/customers/changes", params={"since": page["next_token"]}).json()
+    assert [change["customer"]["firstname"] for change in page["changes"]] == ["New"]
+
+    empty = client.get("/customers/changes", params={"since": page["next_token"]}).json()
+    assert empty == {"changes": [], "next_token": page["next_token"], "has_more": False}
+
+def test_deleting_a_customer_tombstones_its_purchases(client):
+    client.post("/purchases/", json={"customer_id": 1, "purchase_name": "second"})
+    assert client.delete("/customer/1").status_code == 200
+
+    changes, _ = read_feed(client, "/purchases/changes", limit=100)
+    assert [(change["purchase_id"], change["deleted"]) for change in changes] == [(1, True), (2, True)]
+    assert client.get("/purchases").json() == []
+
+def test_retention_tombstones_the_removed_purchases(client):
+    for purchase_date in ("2020-01-05", "2021-03-01", "2022-01-01"):
+        client.post("/purchases/", json={"customer_id": 1, "purchase_date": purchase_date})
+    assert client.delete("/purchases/retention", params={"before": "2021-06-01"}).json() == {"partitions_dropped": [], "rows_deleted": 2}
+
+    changes, _ = read_feed(client, "/purchases/changes", limit=100)
+    assert [(change["purchase_id"], change["deleted"]) for change in changes] == [(1, False), (4, False), (2, True), (3, True)]
@@ -0,0 +1,12 @@
+import benchmark
+
+# importing main is what every worker pays on boot. The first run also compiles the .pyc files, so the best of 5 counts
+def test_import_main_within_budget():
+    share, total, frameworks, slowest = min(benchmark.measure_import_time("main") for _ in range(5))
+    slowest = ", ".join(name + " {:.0f} ms".format(cumulative / 1000) for cumulative, name in slowest[:5])
+    assert share <= benchmark.IMPORT_BUDGET, \
+        "import main took {:.0f} ms, {:.2f} on top of the frameworks' {:.0f} ms, budget {} (slowest: {})".format(
+            total / 1000, share, frameworks / 1000, benchmark.IMPORT_BUDGET, slowest)
+
+def test_import_main_leaves_optional_modules_alone():
+    assert benchmark.eagerly_imported("main") == []
@@ -0,0 +1,54 @@
+from datetime import date
+import pytest
+from sqlalchemy import exc
+from sqlalchemy.schema import CreateTable
+from sqlalchemy.dialects import oracle
+from app import crud, database, model
+
+def feed(client):
+    changes = client.get("/purchases/changes", params={"limit": 1000}).json()["changes"]
+    return [(change["purchase_id"], change["deleted"]) for change in changes]
+
+def add_purchases(client, *purchase_dates):
+    for purchase_date in purchase_dates:
+        client.post("/purchases/", json={"customer_id": 1, "purchase_date": purchase_date})
+
+def test_retention_deletes_everything_before_the_date(client):
+    add_purchases(client, "2019-12-31", "2020-01-05", "2021-06-01")
+    assert client.delete("/purchases/retention", params={"before": "2021-06-01"}).json() == {"partitions_dropped": [], "rows_deleted": 2}
+    assert [purchase["purchase_date"] for purchase in client.get("/purchases").json()] == [date.today().isoformat(), "2021-06-01"]
+    assert feed(client)[-2:] == [(2, True), (3, True)]
+
+def test_hidden_tombstones_only_show_up_once_published(client):
+    add_purchases(client, "2020-01-05", "2020-01-06")
+    db = database.SessionLocal()
+    try:
+        first_seq, count = crud.add_tombstones_where(db, model.Purchase, model.Purchase.purchase_id, model.Purchase.purchase_date < date(2021, 1, 1), hidden=True)
+        db.commit()
+        assert count == 2 and (2, True) not in feed(client)
+
+        # an update made before the partition goes has to come before its tombstone in the feed
+        client.put("/purchase/", json={"purchase_id": 2, "customer_id": 1, "purchase_date": "2020-01-05", "purchase_name": "late"})
+        crud.publish_tombstones(db, first_seq, count)
+        db.commit()
+    finally:
+        db.close()
+    assert feed(client)[-2:] == [(2, True), (3, True)]
+
+def test_failed_partition_drop_leaves_no_tombstones(client):
+    add_purchases(client, "2020-01-05")
+    db = database.SessionLocal()
+    try:
+        with pytest.raises(exc.DBAPIError):
+            crud.drop_purchase_partition(db, "sys_p1", date(2020, 1, 1), date(2020, 2, 1))
+    finally:
+        db.close()
+    assert [purchase_id for purchase_id, deleted in feed(client) if deleted] == []
+    assert len(client.get("/purchases").json()) == 2
+
+def test_partitioned_table_enables_row_movement(monkeypatch):
+    monkeypatch.setattr(database, "settings", database.Settings())
+    monkeypatch.setattr(database.settings, "purchase_partition_interval", "MONTH")
+    ddl = str(CreateTable(model.Purchase.__table__).compile(dialect=oracle.dialect()))
+    assert "INTERVAL (NUMTOYMINTERVAL(1, 'MONTH'))" in ddl
+    assert ddl.rstrip().endswith("ENABLE ROW MOVEMENT")